@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List
+
+from components import Extract, Parser
+
+# Event-loop lag while pages are being parsed, for each PARSE_MODE.
+#
+# A ticker coroutine asks to wake up every `interval` seconds and records how
+# late it actually ran; that lateness is what an unrelated request (/, /reviews)
+# would wait on top of its own work. Meanwhile `concurrency` coroutines parse
+# synthetic letterboxd pages the same way compile_data does.
+#
+#   python -m benchmarks.event_loop_lag
+#   python -m benchmarks.event_loop_lag --modes inline process --pages 400 --json
+
+def chrome(size: int) -> str:
+    # real pages carry a lot of navigation, footer and script markup around the
+    # parts we extract, and the parser has to get through all of it
+    items = ''.join(f'<li class="nav-item"><a href="/section/{i}/" class="nav-link">Section {i}</a></li>' for i in range(size))
+    return f'<header><nav><ul class="nav">{items}</ul></nav></header><script>var config = {{"a": 1}};</script>'
+
+def films_page(page: int, padding: int) -> str:
+    posters = []
+    for i in range(page * 72, (page + 1) * 72):
+        rating = f'<span class="rating -micro -darker rated-{i % 10 + 1}">★★★</span>' if i % 3 else ''
+        like = '<span class="like liked-micro has-icon icon-liked icon-16"></span>' if i % 4 == 0 else ''
+        posters.append(
+            f'<li class="poster-container"><div class="really-lazy-load poster film-poster" data-film-slug="film-{i}" '
+            f'data-target-link="/film/film-{i}/"><img alt="Film {i}" src="/img/{i}.jpg"/></div>'
+            f'<p class="poster-viewingdata">{rating}{like}</p></li>'
+        )
+    pages = ''.join(f'<li class="paginate-page"><a href="/u/films/page/{p}/">{p}</a></li>' for p in range(1, 11))
+    return f'<html><body>{chrome(padding)}<ul class="poster-list">{"".join(posters)}</ul><div class="paginate-pages"><ul>{pages}</ul></div>{chrome(padding)}</body></html>'
+
+def film_page(i: int, padding: int) -> str:
+    cast = ''.join(f'<a href="/actor/a{i}-{k}/" class="text-slug tooltip">Actor {k}</a>' for k in range(40))
+    return (
+        f'<html><body>{chrome(padding)}<div id="tab-cast"><div class="cast-list text-sluglist"><p>{cast}</p></div></div>'
+        f'<div id="tab-crew"><div class="text-sluglist"><p><a href="/director/d{i}/" class="text-slug">Director {i}</a></p></div></div>'
+        f'<div id="tab-genres"><div class="text-sluglist capitalize"><p><a class="text-slug" href="/g">Drama</a></p></div>'
+        f'<div class="text-sluglist capitalize"><p><a class="text-slug" href="/t1">Theme {i}</a><a href="/more">Show All…</a></p></div></div>'
+        f'<a href="https://www.themoviedb.org/movie/{1000 + i}/" class="micro-button track-event" data-track-action="TMDb">TMDb</a>'
+        f'{chrome(padding)}</body></html>'
+    )
+
+async def ticker(interval: float, lags: List[float], stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - start - interval, 0))
+
+async def workload(pages: List[str], concurrency: int) -> None:
+    queue = list(enumerate(pages))
+
+    async def worker():
+        while queue:
+            i, html = queue.pop()
+            if i % 2:
+                await Parser.run(Extract.metadata, html)
+            else:
+                await Parser.run(Extract.movie_links, html)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def measure(pages: List[str], concurrency: int, interval: float) -> Dict[str, float]:
+    lags: List[float] = []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(interval, lags, stop))
+    await asyncio.sleep(interval * 5)  # baseline ticks before the load starts
+
+    start = time.perf_counter()
+    await workload(pages, concurrency)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await tick
+    lags.sort()
+    return {
+        'wall_s': round(elapsed, 3),
+        'pages_per_s': round(len(pages) / elapsed, 1),
+        'lag_p50_ms': round(statistics.median(lags) * 1000, 2),
+        'lag_p99_ms': round(lags[int(len(lags) * 0.99) - 1] * 1000, 2),
+        'lag_max_ms': round(lags[-1] * 1000, 2),
+        'ticks': len(lags),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event-loop lag while parsing pages, per PARSE_MODE")
+    parser.add_argument('--modes', nargs='+', default=list(Parser.PARSE_MODES), choices=Parser.PARSE_MODES)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--padding', type=int, default=600, help="navigation items around each page's content")
+    parser.add_argument('--concurrency', type=int, default=24)
+    parser.add_argument('--workers', type=int, default=Parser.PARSE_WORKERS)
+    parser.add_argument('--interval', type=float, default=0.005, help="ticker interval in seconds")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    pages = [films_page(i, args.padding) if i % 2 == 0 else film_page(i, args.padding) for i in range(args.pages)]
+    page_kb = sum(len(page) for page in pages) / len(pages) / 1024
+
+    results = {}
+    for mode in args.modes:
+        Parser.start_pool(mode, args.workers)
+        try:
+            # warm up the pool so worker start-up isn't counted as lag
+            asyncio.run(workload(pages[:args.workers * 2], args.workers))
+            results[mode] = asyncio.run(measure(pages, args.concurrency, args.interval))
+        finally:
+            Parser.stop_pool()
+
+    if args.json:
+        print(json.dumps({'pages': args.pages, 'page_kb': round(page_kb, 1), 'workers': args.workers, 'results': results}, indent=2))
+        return
+
+    print(f"{args.pages} pages of ~{page_kb:.0f} KB, {args.concurrency} in flight, {args.workers} workers")
+    print(f"{'mode':<8} {'wall s':>8} {'pages/s':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for mode, r in results.items():
+        print(f"{mode:<8} {r['wall_s']:>8} {r['pages_per_s']:>8} {r['lag_p50_ms']:>11} {r['lag_p99_ms']:>11} {r['lag_max_ms']:>11}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import json
+import platform
+import statistics
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+
+from benchmarks.processor import synthetic_films, processor
+from benchmarks.scrape import git_commit
+
+# Processor.monthly_summary against the per-month loop it replaced, on synthetic
+# diaries spread over ten years. Checks that both give the same output before
+# timing them.
+#
+#   python -m benchmarks.monthly_summary
+#   python -m benchmarks.monthly_summary --films 1000 10000 --years 10 --output monthly.json
+
+def legacy_monthly_summary(self) -> List[Dict[str, Any]]:
+
+    def most_watched(df, feature):
+        col = df[feature]
+        counts = col.dropna().explode().value_counts()
+        data = counts[counts > 1].nlargest(2)
+        return data.to_dict()
+
+    data = []
+
+    df = self.df
+    for i in df['last_watched'].dt.to_period('M').unique():
+        year = i.year
+        month = i.month
+
+        filtered_data = df[
+            (df['user_rating'] != 0) &
+            (df['last_watched'].dt.year == year) &
+            (df['last_watched'].dt.month == month)
+        ]
+
+        if filtered_data.shape[0] == 0:
+            continue
+
+        data.append({'time' : f'{year}-{month}',
+                'data' : {
+                            'total_movies' : filtered_data.shape[0],
+                            'most_watched_genre': most_watched(filtered_data, 'genres'),
+                            'most_watched_country': most_watched(filtered_data, 'countries'),
+                            'most_watched_director': most_watched(filtered_data, 'director'),
+                            'most_watched_year': most_watched(filtered_data, 'release_year'),
+                            'most_watched_theme': most_watched(filtered_data, 'themes'),
+                            'most_watched_language': most_watched(filtered_data, 'spoken_languages'),
+                            'most_watched_actor': most_watched(filtered_data, 'actors'),
+                }
+        })
+    return data
+
+METHODS = {
+    'monthly_summary': legacy_monthly_summary,
+}
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def run_size(n: int, years: float, repeat: int, seed: int) -> Dict[str, Any]:
+    p = processor(synthetic_films(n, seed, years=years))
+    p.preprocess_df()
+    results = {}
+    for method, legacy in METHODS.items():
+        new = getattr(p, method)
+        # json round trip so the comparison is of what the API sends, key order included
+        same = json.dumps(new(), default=str) == json.dumps(legacy(p), default=str)
+        legacy_s, new_s = timed(lambda: legacy(p), repeat), timed(new, repeat)
+        results[method] = {
+            'identical': same,
+            'legacy_ms': round(legacy_s * 1000, 3),
+            'new_ms': round(new_s * 1000, 3),
+            'speedup': round(legacy_s / new_s, 1),
+        }
+    return {'films': n, 'years': years, 'months': int(p.df['last_watched'].dt.to_period('M').nunique()), 'methods': results}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="monthly_summary against the loop it replaced")
+    parser.add_argument('--films', nargs='+', type=int, default=[1000, 5000, 20000])
+    parser.add_argument('--years', type=float, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        'benchmark': 'monthly_summary',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': [run_size(n, args.years, args.repeat, args.seed) for n in args.films],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
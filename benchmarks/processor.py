@@ -0,0 +1,178 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from components.DataProcessor import Processor, personal_identity, escapist
+from components.MovieScraper import MovieData
+from benchmarks.scrape import git_commit
+
+# Processor analytics on synthetic diaries, one timing and one memory figure per method.
+#
+#   python -m benchmarks.processor
+#   python -m benchmarks.processor --sizes 1000 20000 --repeat 5 --output processor.json
+#
+# Each method runs on an already preprocessed frame, the way main() calls it, so
+# the numbers are per analytic. 'main' is a whole Processor run from the raw
+# records, including building the frame and preprocess_df.
+
+PUBLIC = Path(__file__).resolve().parent.parent / 'public'
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family', 'Fantasy',
+          'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Science Fiction', 'TV Movie', 'Thriller', 'War', 'Western']
+
+METHODS = [
+    'basic_info', 'log_activity', 'like_to_watch_movie', 'high_rated_genres_themes', 'monthly_summary',
+    'diversity_score', 'obscurity_score', 'word_cloud', 'get_user_type', 'achievements',
+]
+
+def zipf_choice(rng: np.random.Generator, items: List[Any], size: int, a: float = 1.3) -> List[Any]:
+    # a few items very common, a long tail of rare ones, like real diaries
+    ranks = np.minimum(rng.zipf(a, size), len(items)) - 1
+    return [items[i] for i in ranks]
+
+def synthetic_films(n: int, seed: int = 0, years: Optional[float] = None) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    countries = pd.read_csv(PUBLIC / 'continents.csv', encoding='utf-8-sig')['Country'].tolist()
+    languages = pd.read_csv(PUBLIC / 'code.csv')
+    codes, names = languages['ISO_code'].tolist(), languages['Language'].tolist()
+    # English first so it dominates, the rest shuffled into a long tail
+    order = [codes.index('en')] + [i for i in rng.permutation(len(codes)) if codes[i] != 'en']
+    codes, names = [codes[i] for i in order], [names[i] for i in order]
+    countries = ['United States of America', 'United Kingdom', 'France', 'Japan'] + [c for c in rng.permutation(countries) if c not in ('United States of America', 'United Kingdom', 'France', 'Japan')]
+
+    themes = personal_identity + escapist + [f'Theme {i}' for i in range(60)]
+    nanogenres = [f'Nanogenre {i}' for i in range(800)]
+    actors = [f'Actor {i}' for i in range(max(200, n * 3))]
+    directors = [f'Director {i}' for i in range(max(50, n // 2))]
+
+    today = date(2024, 12, 31)
+    # bigger diaries cover more years unless told how many
+    watched_span = int(years * 365) if years else min(365 * 12, 60 + n // 2)
+
+    films = []
+    for i in range(n):
+        release = date(int(min(2024, max(1900, rng.normal(2000, 20)))), int(rng.integers(1, 13)), int(rng.integers(1, 29)))
+        watched = today - timedelta(days=int(rng.integers(0, watched_span)))
+        language = zipf_choice(rng, list(range(len(codes))), 1, a=1.6)[0]
+        rating = round(float(np.clip(rng.normal(3.5, 0.5), 0.5, 5)), 2)
+        rated = rng.random() < 0.8
+        watched_by = int(rng.lognormal(11, 2))
+
+        films.append(MovieData(
+            title=f'Film {i}',
+            tmdb_id=100000 + i,
+            release_date=release.isoformat(),
+            countries=list(dict.fromkeys(zipf_choice(rng, countries, int(rng.integers(1, 3)), a=1.5))),
+            spoken_languages=list(dict.fromkeys([names[language]] + zipf_choice(rng, names, int(rng.integers(0, 2)), a=1.6))) if rng.random() > 0.02 else [],
+            original_language=codes[language],
+            runtime=int(rng.integers(70, 200)),
+            genres=list(dict.fromkeys(zipf_choice(rng, GENRES, int(rng.integers(1, 4)), a=1.2))),
+            actors=list(dict.fromkeys(zipf_choice(rng, actors, 3, a=1.1))),
+            director=zipf_choice(rng, directors, 1, a=1.1)[0],
+            themes=list(dict.fromkeys(zipf_choice(rng, themes, int(rng.integers(0, 4)), a=1.2))),
+            nanogenres=list(dict.fromkeys(zipf_choice(rng, nanogenres, int(rng.integers(1, 6)), a=1.1))),
+            last_watched=watched.isoformat(),
+            is_rewatched=bool(rng.random() < 0.1),
+            rating=rating,
+            rating_count=int(watched_by * rng.uniform(0.3, 0.8)),
+            stats_watched=watched_by,
+            stats_liked=int(watched_by * rng.uniform(0.05, 0.4)),
+            stats_rank=int(rng.integers(1, 251)) if rng.random() < 0.03 else 0,
+            user_rating=float(np.clip(round((rating + rng.normal(0, 0.7)) * 2) / 2, 0.5, 5)) if rated else 0,
+            is_liked=bool(rng.random() < 0.2),
+            is_reviewed=bool(rng.random() < 0.1),
+            slug=f'film-{i}',
+        ).model_dump())
+    return films
+
+def processor(films: List[Dict[str, Any]]) -> Processor:
+    p = Processor(films, 'bench')
+    p.profile_header = ('https://a.ltrbxd.com/bench.jpg', 'Bench')  # no profile fetch
+    return p
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'min_ms': round(min(times) * 1000, 3),
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'peak_alloc_mb': round(peak / 2**20, 3),
+    }
+
+def run_size(n: int, repeat: int, seed: int) -> Dict[str, Any]:
+    films = synthetic_films(n, seed)
+    results = {'construct': measure(lambda: processor(films), repeat)}
+
+    def preprocess():
+        p = processor(films)
+        p.preprocess_df()
+    results['preprocess_df'] = measure(preprocess, repeat)
+
+    p = processor(films)
+    p.preprocess_df()
+    for method in METHODS:
+        # start each call without the derived values an earlier call memoized
+        def call(fn=getattr(p, method)):
+            p.memo.clear()
+            return fn()
+        results[method] = measure(call, repeat)
+
+    results['main'] = measure(lambda: processor(films).main(), repeat)
+    return {'films': n, 'methods': results}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-method timing and memory of Processor on synthetic diaries")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 5000, 20000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, help="write the JSON here instead of stdout")
+    parser.add_argument('--table', action='store_true', help="print a readable table to stderr as well")
+    args = parser.parse_args()
+
+    runs = []
+    for n in args.sizes:
+        runs.append(run_size(n, args.repeat, args.seed))
+        if args.table:
+            print(f"\n{n} films", file=sys.stderr)
+            for method, r in runs[-1]['methods'].items():
+                print(f"  {method:<26} {r['median_ms']:>10.2f} ms {r['peak_alloc_mb']:>9.2f} MB", file=sys.stderr)
+
+    report = {
+        'benchmark': 'processor',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
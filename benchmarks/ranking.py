@@ -0,0 +1,196 @@
+import argparse
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy
+from sklearn.metrics.pairwise import cosine_similarity
+
+from components.Ranking import Ranking, rating_matrix
+from benchmarks.scrape import git_commit
+
+# Ranking.rank (similarity and recommendations) on synthetic friend groups,
+# against the dense pivot_table pipeline it replaced. Checks both agree before
+# timing them. rank() starts from the integer arrays users.db hands back, so
+# the sparse timings leave out loading them.
+#
+#   python -m benchmarks.ranking
+#   python -m benchmarks.ranking --friends 50 200 1000 --films 1500 --legacy-max 200
+#   python -m benchmarks.ranking --min-raters 3 --shrinkage 5
+#
+# The dense pipeline needs friends x distinct films floats several times over,
+# so it only runs up to --legacy-max friends.
+
+def synthetic_group(friends: int, films: int, seed: int = 0, pool: int = 200000) -> Tuple[Dict[str, List[Any]], List[str]]:
+    rng = np.random.default_rng(seed)
+    # a few films everyone has seen, a long tail most haven't
+    popularity = 1 / np.arange(1, pool + 1) ** 0.8
+    popularity /= popularity.sum()
+
+    names = [f'Friend {i}' for i in range(friends)] + ['Me']
+    data = {'user': [], 'title': [], 'rating': [], 'links': []}
+    for name in names:
+        n = int(np.clip(rng.lognormal(np.log(films), 0.6), 20, pool // 4))
+        logged = pd.unique(rng.choice(pool, int(n * 1.5), p=popularity))[:n]
+        ratings = np.where(rng.random(len(logged)) < 0.7, rng.integers(1, 11, len(logged)) / 2, 0)
+        data['user'].extend([name] * len(logged))
+        data['links'].extend(f'/film/film-{i}/' for i in logged)
+        data['title'].extend(f'Film {i}' for i in logged)
+        data['rating'].extend(ratings.tolist())
+    return data, names
+
+def ranking(data: Dict[str, List[Any]], names: List[str]) -> Ranking:
+    r = Ranking('me', 'both', None)
+    r.name_map = {name.lower().replace(' ', ''): name for name in names[:-1]}
+    r.name_map['me'] = 'Me'
+    r.rev_name_map = {name: user for user, name in r.name_map.items()}
+    r.pic_map = {name: '' for name in names}
+    return r
+
+def group_arrays(r: Ranking, data: Dict[str, List[Any]]) -> Tuple[Dict[str, Any], pd.Index]:
+    # the group as fetch_group_ratings returns it, film ids handed out in link order
+    # so ties break the way they did on links
+    usernames = list(r.name_map)
+    positions = {r.name_map[user]: i for i, user in enumerate(usernames)}
+    films, links = pd.factorize(pd.Series(data['links'], dtype=object), sort=True)
+    return {
+        'users': usernames,
+        'user': np.array([positions[name] for name in data['user']], dtype=np.int64),
+        'film': films.astype(np.int64),
+        'rating': np.array(data['rating'], dtype=np.float64),
+    }, links
+
+def legacy_rank(self: Ranking, data: Dict[str, List[Any]]) -> Dict[str, Any]:
+    user = self.name_map[self.user]
+
+    def recommend_movies(pivot_table, user_similarity_df, n_recommendations=10):
+        user_ratings = pivot_table.loc[user]
+        sum_of_sim = user_similarity_df.drop(columns=[user]).loc[user].sum()
+        similar_users = user_similarity_df[user].sort_values(ascending=False)
+        recommendations = pd.Series()
+
+        for similar_user, similarity_score in similar_users.items():
+            if similar_user != user:
+                similar_user_ratings = pivot_table.loc[similar_user]
+                unrated_movies = similar_user_ratings[user_ratings == 0]
+                recommendations = recommendations.add(unrated_movies * similarity_score, fill_value=0)
+
+        recommendations = recommendations / sum_of_sim
+        recommendations = recommendations.sort_values(ascending=False)
+        return recommendations.head(n_recommendations).to_dict()
+
+    df = pd.DataFrame(data)
+    rating_pivot = df.pivot_table(index='user', columns='links', values='rating', aggfunc='mean')
+    updated_ratings = rating_pivot.fillna(0) + 1
+    updated_ratings[rating_pivot.isna()] = None
+    rating_pivot = updated_ratings.fillna(0)
+
+    index_to_keep = rating_pivot.loc[user][rating_pivot.loc[user] != 0].index
+    filtered_pivot = rating_pivot.loc[:, index_to_keep]
+    user_similarity = cosine_similarity(filtered_pivot)
+    user_similarity_df = pd.DataFrame(user_similarity, index=rating_pivot.index, columns=rating_pivot.index)
+
+    rankings = user_similarity_df.drop(columns=[user]).loc[user].sort_values(ascending=False).to_dict()
+    reccomendations = recommend_movies(rating_pivot, user_similarity_df)
+    return {'rankings': rankings, 'reccomendations': reccomendations}
+
+def agreement(new: Dict[str, Any], legacy: Dict[str, Any], links: pd.Index) -> Dict[str, Any]:
+    # similarities come from a sparse product instead of a dense one, so they can
+    # differ in the last bits; order and values are compared separately
+    result = {}
+    for key in ('rankings', 'reccomendations'):
+        if key == 'rankings':
+            a = {k: v['similarity'] for k, v in new[key].items()}
+        else:
+            a = {links[k]: v for k, v in new[key].items()}
+        b = legacy[key]
+        result[key] = {
+            'same_order': list(a) == list(b),
+            'max_abs_diff': max((abs(a[k] - b[k]) for k in a if k in b), default=0.0) if a.keys() == b.keys() else None,
+        }
+    return result
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'min_ms': round(min(times) * 1000, 3),
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'peak_alloc_mb': round(peak / 2**20, 3),
+    }
+
+def run_size(friends: int, films: int, repeat: int, seed: int, legacy_max: int, min_raters: int, shrinkage: float) -> Dict[str, Any]:
+    data, names = synthetic_group(friends, films, seed)
+    r = ranking(data, names)
+    group, links = group_arrays(r, data)
+
+    # recommend_movies on its own, from the matrix and similarities rank() builds
+    ratings, users, film_ids = rating_matrix([r.name_map[user] for user in group['users']], group['user'], group['film'], group['rating'])
+    me = users.get_loc('Me')
+    logged = ratings[:, ratings[me].indices]
+    similarity = cosine_similarity(logged, logged[me]).ravel()
+
+    result = {
+        'friends': friends,
+        'ratings': len(data['links']),
+        'distinct_films': len(set(data['links'])),
+        'sparse': measure(lambda: r.rank(group), repeat),
+        'recommend': measure(lambda: r.recommend_movies(ratings, users, film_ids, similarity,
+                                                        min_raters=min_raters, shrinkage=shrinkage), repeat),
+    }
+    if friends <= legacy_max:
+        result['dense'] = measure(lambda: legacy_rank(r, data), repeat)
+        result['agreement'] = agreement(r.rank(group), legacy_rank(r, data), links)
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sparse Ranking.rank against the dense pivot_table pipeline")
+    parser.add_argument('--friends', nargs='+', type=int, default=[50, 200, 1000])
+    parser.add_argument('--films', type=int, default=1500, help="median films per friend")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--legacy-max', type=int, default=200, help="largest group to run the dense pipeline on")
+    parser.add_argument('--min-raters', type=int, default=1, help="recommend_movies min_raters for the 'recommend' timing")
+    parser.add_argument('--shrinkage', type=float, default=0, help="recommend_movies shrinkage for the 'recommend' timing")
+    parser.add_argument('--output', type=Path, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        'benchmark': 'ranking',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'min_raters': args.min_raters,
+        'shrinkage': args.shrinkage,
+        'results': [run_size(n, args.films, args.repeat, args.seed, args.legacy_max, args.min_raters, args.shrinkage) for n in args.friends],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
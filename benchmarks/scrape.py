@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.upstream import Synthetic, Upstream, serve
+
+# End-to-end scrape benchmark against the local stand-in (benchmarks/upstream.py).
+#
+# Runs MovieDataScraper.scrape, ReviewScraper.scrape and Ranking.rank_friends for
+# synthetic users of each size and prints one JSON document. Film scrapes run
+# cold (empty databases and caches), warm (full rescan, film data cached) and
+# refresh (incremental from the snapshot); rankings run cold and warm.
+#
+#   python -m benchmarks.scrape > results.json
+#   python -m benchmarks.scrape --films 100 1000 --friends 10 100 --output results.json
+#
+# The stand-in and the app share this process, so the numbers include parsing
+# and processing but no real network. Rate limits are lifted unless
+# --production-limits is given; this measures our hot paths, not upstream politeness.
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # no procfs: fall back to the lifetime peak
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+async def sample_rss(peak: List[int], stop: asyncio.Event, interval: float = 0.05) -> None:
+    while not stop.is_set():
+        peak[0] = max(peak[0], rss_bytes())
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Bench:
+
+    def __init__(self, upstream: Upstream, production_limits: bool):
+        from components.MovieScraper import MovieDataScraper
+        from components.Session import governor
+        self.upstream = upstream
+        self.caches = {
+            'static': MovieDataScraper.static_cache,
+            'semistatic': MovieDataScraper.semistatic_cache,
+        }
+        if not production_limits:
+            for host in list(governor.policies):
+                governor.policies[host] = (100000, 100000, 64)
+
+    @staticmethod
+    def drop(db, path: Path) -> None:
+        db.close()
+        for suffix in ['', '-wal', '-shm']:
+            Path(str(path) + suffix).unlink(missing_ok=True)
+
+    def reset_state(self) -> None:
+        from database import database
+        self.drop(database.movies, database.db)
+        self.drop(database.users, database.users_db)
+        self.drop(database.snapshots, database.snapshots_db)
+        for cache in self.caches.values():
+            cache.entries.clear()
+
+    def reset_snapshots(self) -> None:
+        from database import database
+        self.drop(database.snapshots, database.snapshots_db)
+
+    def flush(self) -> None:
+        from database import database
+        for db in [database.movies, database.users, database.snapshots]:
+            db.flush()
+
+    async def run(self, scenario: str, run: str, films: int, fn: Callable[[], Awaitable[Any]],
+                  count: Callable[[Any], int]) -> Dict[str, Any]:
+        before = {name: cache.stats() for name, cache in self.caches.items()}
+        self.upstream.reset()
+        peak = [rss_bytes()]
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(peak, stop))
+
+        start = time.perf_counter()
+        error = None
+        try:
+            result = await fn()
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        wall = time.perf_counter() - start
+
+        stop.set()
+        await sampler
+        self.flush()
+
+        upstream = self.upstream.stats()
+        cache = {}
+        for name, cache_ in self.caches.items():
+            after = cache_.stats()
+            hits = after['hits'] - before[name]['hits']
+            misses = after['misses'] - before[name]['misses']
+            cache[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+
+        return {
+            'scenario': scenario,
+            'run': run,
+            'films': films,
+            'items': count(result) if result is not None else 0,
+            'wall_s': round(wall, 3),
+            'requests': upstream['total'],
+            'requests_per_film': round(upstream['total'] / films, 3) if films else None,
+            'requests_by_pattern': upstream['requests'],
+            'upstream_errors': upstream['errors'],
+            'peak_concurrency': upstream['peak_concurrency'],
+            'cache': cache,
+            'peak_rss_mb': round(peak[0] / 2**20, 1),
+            'error': error,
+        }
+
+async def run_suite(args: argparse.Namespace) -> Dict[str, Any]:
+    synthetic = Synthetic(films=args.friend_films, pool=args.pool)
+    upstream = Upstream(synthetic, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    port, tmdb_port = free_port(), free_port()
+    runner = await serve(upstream, port=port, tmdb_port=tmdb_port)
+
+    # the app reads these at import time, so import it only now
+    os.environ['LETTERBOXD_URL'] = f'http://127.0.0.1:{port}'
+    os.environ['TMDB_URL'] = f'http://127.0.0.1:{tmdb_port}'
+    os.environ['DB_DIR'] = args.db_dir
+    from components.MovieScraper import MovieDataScraper
+    from components.ReviewScraper import ReviewScraper
+    from components.Ranking import Ranking
+    from components.Session import create_session
+    from components import Parser
+
+    Parser.start_pool(args.parse_mode)
+    session = create_session()
+    bench = Bench(upstream, args.production_limits)
+    results = []
+    try:
+        for films in args.films:
+            if 'movies' in args.scenarios:
+                user = f'bench-movies-{films}'
+                synthetic.film_counts[user] = films
+                bench.reset_state()
+                for run in ['cold', 'warm', 'refresh']:
+                    if run == 'warm':
+                        bench.reset_snapshots()
+                    results.append(await bench.run('movies', run, films, lambda: MovieDataScraper(user, session).scrape(), len))
+                    print(f"movies {films} {run}: {results[-1]['wall_s']}s", file=sys.stderr)
+
+            if 'reviews' in args.scenarios:
+                user = f'bench-reviews-{films}'
+                synthetic.film_counts[user] = films
+                synthetic.reviews = max(1, int(films * args.review_share))
+                bench.reset_state()
+                results.append(await bench.run('reviews', 'cold', films, lambda: ReviewScraper(user, session).scrape(), len))
+                print(f"reviews {films}: {results[-1]['wall_s']}s", file=sys.stderr)
+
+        if 'rank' in args.scenarios:
+            for friends in args.friends:
+                user = f'bench-rank-{friends}'
+                synthetic.film_counts[user] = args.friend_films
+                synthetic.friend_counts[user] = friends
+                bench.reset_state()
+                for run in ['cold', 'warm']:
+                    result = await bench.run('rank', run, args.friend_films * (friends + 1),
+                                             lambda: Ranking(user, 'followers', session).rank_friends(),
+                                             lambda r: len(r.get('rankings', {})))
+                    result['friends'] = friends
+                    results.append(result)
+                    print(f"rank {friends} {run}: {result['wall_s']}s", file=sys.stderr)
+    finally:
+        await session.close()
+        Parser.stop_pool()
+        bench.reset_state()
+        await runner.cleanup()
+
+    return {
+        'benchmark': 'scrape',
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'parse_mode': args.parse_mode,
+            'production_limits': args.production_limits,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate,
+            'friend_films': args.friend_films,
+        },
+        'results': results,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end scrape benchmark against the local stand-in")
+    parser.add_argument('--scenarios', nargs='+', default=['movies', 'reviews', 'rank'], choices=['movies', 'reviews', 'rank'])
+    parser.add_argument('--films', nargs='+', type=int, default=[100, 1000, 5000], help="film counts for the scraped user")
+    parser.add_argument('--friends', nargs='+', type=int, default=[10, 100, 500], help="friend counts for the ranking")
+    parser.add_argument('--friend-films', type=int, default=300, help="average films per friend, and the ranked user's films")
+    parser.add_argument('--review-share', type=float, default=0.1, help="share of films the reviews user has reviewed")
+    parser.add_argument('--pool', type=int, default=20000, help="distinct films across all synthetic users")
+    parser.add_argument('--parse-mode', default='inline', choices=['inline', 'thread', 'process'])
+    parser.add_argument('--production-limits', action='store_true', help="keep the real per-host rate limits")
+    # without some latency every request finishes before the next starts and concurrency can't be seen
+    parser.add_argument('--latency', type=float, default=0.01, help="mean upstream latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.005)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--db-dir', help="scratch directory for the databases, empty or not there yet (default: a temporary one)")
+    parser.add_argument('--output', type=Path, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    # every scenario deletes the databases in it, so never point it at real ones
+    if args.db_dir and Path(args.db_dir).exists() and any(Path(args.db_dir).iterdir()):
+        parser.error(f"--db-dir {args.db_dir} is not empty")
+
+    with tempfile.TemporaryDirectory(prefix='unboxd-bench-') as tmp:
+        if args.db_dir:
+            Path(args.db_dir).mkdir(parents=True, exist_ok=True)
+        args.db_dir = args.db_dir or tmp
+        report = asyncio.run(run_suite(args))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
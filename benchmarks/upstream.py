@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+import aiohttp
+from aiohttp import web
+
+# Local stand-in for letterboxd.com and api.themoviedb.org, so the scrapers can
+# be benchmarked and regression-tested offline.
+#
+#   python -m benchmarks.upstream --port 8081 --tmdb-port 8082 --latency 0.08 --jitter 0.03 --error-rate 0.01
+#   LETTERBOXD_URL=http://127.0.0.1:8081 TMDB_URL=http://127.0.0.1:8082 DB_DIR=/tmp/unboxd uvicorn main:app
+#
+# Every URL pattern the scrapers request is answered, in this order, from:
+#   1. a recorded fixture in --fixtures (one file per path, see fixture_path)
+#   2. with --record, the live site; the response is saved as a fixture
+#   3. a synthetic page, deterministic per user/film, with the markup the
+#      Extract functions read
+# GET /_stats returns request counts per pattern and the peak concurrency seen.
+
+FILMS_PER_PAGE = 72
+DIARY_PER_PAGE = 50
+FRIENDS_PER_PAGE = 25
+REVIEWS_PER_PAGE = 12
+
+LIVE_URLS = {'letterboxd': 'https://letterboxd.com', 'tmdb': 'https://api.themoviedb.org'}
+
+# (pattern name, upstream, path regex); the name is what /_stats counts by
+ROUTES: List[Tuple[str, str, str]] = [
+    ('tmdb_movie', 'tmdb', r'^/3/movie/(?P<tmdb_id>\d+)$'),
+    ('film_stats', 'letterboxd', r'^/csi/film/(?P<slug>[^/]+)/stats/$'),
+    ('film_histogram', 'letterboxd', r'^/csi/film/(?P<slug>[^/]+)/rating-histogram/$'),
+    ('film_nanogenres', 'letterboxd', r'^/film/(?P<slug>[^/]+)/nanogenres/$'),
+    ('film', 'letterboxd', r'^/film/(?P<slug>[^/]+)/?$'),
+    ('films_page', 'letterboxd', r'^/(?P<user>[^/]+)/films/(?:page/(?P<page>\d+)/)?$'),
+    ('diary_page', 'letterboxd', r'^/(?P<user>[^/]+)/films/diary/(?:page/(?P<page>\d+)/)?$'),
+    ('reviews_page', 'letterboxd', r'^/(?P<user>[^/]+)/films/reviews/(?:page/(?P<page>\d+)/)?$'),
+    ('friends_page', 'letterboxd', r'^/(?P<user>[^/]+)/(?P<kind>followers|following)/(?:page/(?P<page>\d+)/)?$'),
+    ('activity', 'letterboxd', r'^/(?P<user>[^/]+)/film/(?P<slug>[^/]+)/activity/$'),
+    ('likes', 'letterboxd', r'^/(?P<user>[^/]+)/film/(?P<slug>[^/]+)/(?:\d+/)?likes/?$'),
+    ('review', 'letterboxd', r'^/(?P<user>[^/]+)/film/(?P<slug>[^/]+)/(?:\d+/)?$'),
+    ('profile', 'letterboxd', r'^/(?P<user>[^/]+)/$'),
+]
+
+def seed(*parts: Any) -> int:
+    return zlib.crc32('/'.join(str(part) for part in parts).encode())
+
+def pagination(pages: int) -> str:
+    items = ''.join(f'<li class="paginate-page"><a href="page/{p}/">{p}</a></li>' for p in range(1, pages + 1))
+    return f'<div class="paginate-pages"><ul>{items}</ul></div>'
+
+def page(body: str) -> str:
+    return f'<!DOCTYPE html><html lang="en"><head><title>Letterboxd</title></head><body>{body}</body></html>'
+
+# Synthetic site. Films are drawn from one shared pool so users overlap, which
+# is what the friend ranking needs.
+class Synthetic:
+
+    def __init__(self, films: int = 300, pool: int = 5000, friends: int = 40, reviews: int = 30):
+        self.films = films
+        self.pool = pool
+        self.friends = friends
+        self.reviews = reviews
+        # exact sizes for particular users, e.g. the subject of a benchmark run
+        self.film_counts: Dict[str, int] = {}
+        self.friend_counts: Dict[str, int] = {}
+
+    def user_films(self, user: str) -> List[int]:
+        rng = random.Random(seed('films', user))
+        count = self.film_counts.get(user) or max(1, int(self.films * rng.uniform(0.5, 1.5)))
+        return rng.sample(range(self.pool), min(count, self.pool))
+
+    def user_friends(self, user: str) -> int:
+        return self.friend_counts.get(user, self.friends)
+
+    @staticmethod
+    def slug(film: int) -> str:
+        return f'film-{film}'
+
+    @staticmethod
+    def film_id(slug: str) -> int:
+        match = re.search(r'(\d+)$', slug)
+        return int(match.group(1)) if match else seed(slug) % 100000
+
+    @staticmethod
+    def title(film: int) -> str:
+        return f'Film {film}'
+
+    def watch(self, user: str, film: int) -> Tuple[str, int]:
+        rng = random.Random(seed('watch', user, film))
+        return f'{rng.randint(2012, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}', rng.choice([1, 1, 1, 1, 2, 3])
+
+    def films_page(self, user: str, page_num: int) -> str:
+        films = self.user_films(user)
+        pages = max(1, -(-len(films) // FILMS_PER_PAGE))
+        posters = []
+        for film in films[(page_num - 1) * FILMS_PER_PAGE:page_num * FILMS_PER_PAGE]:
+            rng = random.Random(seed('rating', user, film))
+            rated = rng.randint(0, 10)
+            rating = f'<span class="rating -micro -darker rated-{rated}">★★★</span>' if rated else ''
+            like = '<span class="like liked-micro has-icon icon-liked icon-16"></span>' if rng.random() < 0.2 else ''
+            review = f'<a href="/{user}/film/{self.slug(film)}/" class="review-micro has-icon icon-review tooltip"></a>' if rng.random() < 0.1 else ''
+            posters.append(
+                f'<li class="poster-container"><div class="really-lazy-load poster film-poster" data-film-slug="{self.slug(film)}" '
+                f'data-target-link="/film/{self.slug(film)}/"><img alt="{self.title(film)}" src="/img/{film}.jpg"/></div>'
+                f'<p class="poster-viewingdata">{rating}{like}{review}</p></li>'
+            )
+        return page(f'<ul class="poster-list">{"".join(posters)}</ul>{pagination(pages)}')
+
+    def diary_page(self, user: str, page_num: int) -> str:
+        entries = []
+        for film in self.user_films(user):
+            date, times = self.watch(user, film)
+            year = int(date[:4])
+            for k in range(times):
+                entries.append((f'{year + k}{date[4:]}', film, k > 0))
+        entries.sort(reverse=True)
+
+        pages = max(1, -(-len(entries) // DIARY_PER_PAGE))
+        rows = []
+        for date, film, rewatch in entries[(page_num - 1) * DIARY_PER_PAGE:page_num * DIARY_PER_PAGE]:
+            y, m, d = date.split('-')
+            rewatch_class = 'td-rewatch center' if rewatch else 'td-rewatch center icon-status-off'
+            rows.append(
+                f'<tr class="diary-entry-row viewing-poster-container"><td class="td-day diary-day center">'
+                f'<a href="/{user}/films/diary/for/{y}/{m}/{d}/">{int(d)}</a></td>'
+                f'<td class="td-film-details"><div class="really-lazy-load poster film-poster" data-film-slug="{self.slug(film)}"></div>'
+                f'<h3 class="headline-3 prettify"><a href="/{user}/film/{self.slug(film)}/">{self.title(film)}</a></h3></td>'
+                f'<td class="{rewatch_class}"><span class="has-icon icon-rewatch icon-16"></span></td></tr>'
+            )
+        return page(f'<table><tbody>{"".join(rows)}</tbody></table>{pagination(pages)}')
+
+    def activity(self, user: str, slug: str) -> str:
+        date, times = self.watch(user, self.film_id(slug))
+        rows = []
+        for k in reversed(range(times)):
+            when = f'{int(date[:4]) + k}{date[4:]}'
+            verb = 'rewatched' if k else 'watched'
+            rows.append(f'<section class="activity-row -basic"><p class="activity-summary">{user} {verb} '
+                        f'<a href="/film/{slug}/">film</a> <time datetime="{when}T12:00:00.000Z">x</time></p></section>')
+        return page(''.join(rows))
+
+    def film(self, slug: str) -> str:
+        film = self.film_id(slug)
+        rng = random.Random(seed('film', film))
+        cast = ''.join(f'<a href="/actor/actor-{rng.randint(0, 2000)}/" class="text-slug tooltip">Actor {rng.randint(0, 2000)}</a>' for _ in range(12))
+        themes = ''.join(f'<a class="text-slug" href="/films/theme/t{t}/">Theme {t}</a>' for t in rng.sample(range(60), 3))
+        return page(
+            f'<div id="tab-cast"><div class="cast-list text-sluglist"><p>{cast}</p></div></div>'
+            f'<div id="tab-crew"><h3>Director</h3><div class="text-sluglist"><p>'
+            f'<a href="/director/d{film % 400}/" class="text-slug">Director {film % 400}</a></p></div></div>'
+            f'<div id="tab-genres"><h3>Genres</h3><div class="text-sluglist capitalize"><p><a class="text-slug" href="/films/genre/drama/">Drama</a></p></div>'
+            f'<h3>Themes</h3><div class="text-sluglist capitalize"><p>{themes}<a href="/film/{slug}/themes/">Show All…</a></p></div></div>'
+            f'<p class="text-link text-footer"><a href="https://www.themoviedb.org/movie/{100000 + film}/" '
+            f'class="micro-button track-event" data-track-action="TMDb">TMDb</a></p>'
+        )
+
+    def nanogenres(self, slug: str) -> str:
+        rng = random.Random(seed('nano', slug))
+        sections = ''.join(f'<section><h2 class="title"><a>Nanogenre {n}, Nanogenre {n + 1}</a></h2></section>' for n in rng.sample(range(200), 3))
+        return page(sections)
+
+    def stats(self, slug: str) -> str:
+        rng = random.Random(seed('stats', slug))
+        watched, liked = rng.randint(100, 2000000), rng.randint(10, 500000)
+        top = f'<li><a class="has-icon icon-top250 icon-16 tooltip" title="№ {rng.randint(1, 250)} in the Top 250 ">x</a></li>' if rng.random() < 0.05 else ''
+        return page(
+            f'<ul class="film-stats"><li><a class="has-icon icon-watched icon-16 tooltip" title="Watched by {watched:,} members">x</a></li>'
+            f'<li><a class="has-icon icon-liked icon-16 tooltip" title="Liked by {liked:,} members">x</a></li>{top}</ul>'
+        )
+
+    def histogram(self, slug: str) -> str:
+        rng = random.Random(seed('histogram', slug))
+        return page(
+            f'<span class="average-rating"><a href="/film/{slug}/ratings/" class="tooltip display-rating" '
+            f'title="Weighted average of {rng.uniform(1.5, 4.6):.2f} based on {rng.randint(50, 900000):,} ratings">x</a></span>'
+        )
+
+    def profile(self, user: str) -> str:
+        return page(
+            f'<div class="profile-avatar"><span class="avatar"><img src="https://a.ltrbxd.com/{user}.jpg" alt="{user}"/></span></div>'
+            f'<h1 class="title-1 person-display-name"><span class="label">{user.title()}</span></h1>'
+            f'<div class="profile-stats js-profile-stats">'
+            f'<h4 class="profile-statistic"><a href="/{user}/films/"><span class="value">{len(self.user_films(user))}</span></a></h4>'
+            f'<h4 class="profile-statistic"><a href="/{user}/following/"><span class="value">{self.user_friends(user)}</span></a></h4>'
+            f'<h4 class="profile-statistic"><a href="/{user}/followers/"><span class="value">{self.user_friends(user)}</span></a></h4></div>'
+        )
+
+    def friends_page(self, user: str, kind: str, page_num: int) -> str:
+        people = [f'{user}-{kind[:5]}-{k}' for k in range(self.user_friends(user))]
+        rows = ''.join(
+            f'<tr><td class="table-person"><div class="person-summary"><a class="avatar -a40" href="/{name}/">'
+            f'<img src="https://a.ltrbxd.com/{name}.jpg" alt="{name.title()}" width="40" height="40"/></a>'
+            f'<h3 class="title-3"><a href="/{name}/" class="name">{name.title()}</a></h3></div></td></tr>'
+            for name in people[(page_num - 1) * FRIENDS_PER_PAGE:page_num * FRIENDS_PER_PAGE]
+        )
+        return page(f'<table class="person-table"><tbody>{rows}</tbody></table>')
+
+    def reviewed(self, user: str) -> List[int]:
+        return self.user_films(user)[:self.reviews]
+
+    def reviews_page(self, user: str, page_num: int) -> str:
+        films = self.reviewed(user)
+        pages = max(1, -(-len(films) // REVIEWS_PER_PAGE))
+        items = ''.join(
+            f'<li class="film-detail"><div class="film-detail-content"><h2 class="headline-2 prettify">'
+            f'<a href="/{user}/film/{self.slug(film)}/">{self.title(film)}</a></h2></div></li>'
+            for film in films[(page_num - 1) * REVIEWS_PER_PAGE:page_num * REVIEWS_PER_PAGE]
+        )
+        return page(f'<ul class="film-list">{items}</ul>{pagination(pages)}')
+
+    def review(self, user: str, slug: str) -> str:
+        rng = random.Random(seed('review', user, slug))
+        words = ' '.join(rng.choice(['great', 'slow', 'moving', 'funny', 'odd', 'beautiful', 'long']) for _ in range(40))
+        return page(f'<div class="review body-text -prose -hero prettify"><div><p>{words}</p></div></div>')
+
+    def likes(self, user: str, slug: str) -> str:
+        rng = random.Random(seed('likes', user, slug))
+        names = ''.join(f'<a href="/liker-{rng.randint(0, 500)}/" class="name">Liker</a>' for _ in range(rng.randint(0, 15)))
+        return page(f'<table><tr><td class="table-person">{names}</td></tr></table>')
+
+    def tmdb_movie(self, tmdb_id: int) -> Dict[str, Any]:
+        film = tmdb_id - 100000
+        rng = random.Random(seed('tmdb', film))
+        countries = ['United States of America', 'France', 'Japan', 'South Korea', 'India', 'United Kingdom', 'Italy', 'Brazil']
+        languages = [('en', 'English'), ('fr', 'French'), ('ja', 'Japanese'), ('ko', 'Korean'), ('hi', 'Hindi'), ('it', 'Italian')]
+        genres = ['Drama', 'Comedy', 'Thriller', 'Horror', 'Romance', 'Science Fiction', 'Animation', 'Documentary', 'Crime']
+        code, language = rng.choice(languages)
+        return {
+            'id': tmdb_id,
+            'title': self.title(film),
+            'release_date': f'{rng.randint(1920, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'production_countries': [{'name': name} for name in rng.sample(countries, rng.randint(1, 2))],
+            'spoken_languages': [{'english_name': language}],
+            'runtime': rng.randint(70, 200),
+            'original_language': code,
+            'genres': [{'name': name} for name in rng.sample(genres, rng.randint(1, 3))],
+        }
+
+    def respond(self, name: str, args: Dict[str, str]) -> Any:
+        page_num = int(args.get('page') or 1)
+        if name == 'tmdb_movie':
+            return self.tmdb_movie(int(args['tmdb_id']))
+        if name == 'films_page':
+            return self.films_page(args['user'], page_num)
+        if name == 'diary_page':
+            return self.diary_page(args['user'], page_num)
+        if name == 'reviews_page':
+            return self.reviews_page(args['user'], page_num)
+        if name == 'friends_page':
+            return self.friends_page(args['user'], args['kind'], page_num)
+        if name in ('activity', 'likes', 'review'):
+            return getattr(self, name)(args['user'], args['slug'])
+        if name in ('film', 'film_stats', 'film_histogram', 'film_nanogenres'):
+            return getattr(self, {'film': 'film', 'film_stats': 'stats', 'film_histogram': 'histogram', 'film_nanogenres': 'nanogenres'}[name])(args['slug'])
+        return self.profile(args['user'])
+
+# Recorded fixtures: <dir>/<upstream>/<quoted path>.html|.json, query string dropped
+def fixture_path(root: Path, upstream: str, path: str) -> Path:
+    suffix = '.json' if upstream == 'tmdb' else '.html'
+    return root / upstream / (quote(path.rstrip('/') or '/', safe='') + suffix)
+
+class Upstream:
+
+    def __init__(self, synthetic: Synthetic, fixtures: Optional[Path] = None, record: bool = False,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: int = 1, timeout_rate: float = 0.0):
+        self.synthetic = synthetic
+        self.fixtures = fixtures
+        self.record = record
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.timeout_rate = timeout_rate
+        self.routes = [(name, upstream, re.compile(pattern)) for name, upstream, pattern in ROUTES]
+        self.rng = random.Random(0)
+        self.live: Optional[aiohttp.ClientSession] = None
+
+        self.requests = Counter()
+        self.errors = Counter()
+        self.active = 0
+        self.peak = 0
+        self.started = time.monotonic()
+
+    def match(self, path: str) -> Tuple[Optional[str], Optional[str], Dict[str, str]]:
+        # collapse the //csi the scrapers used to send
+        path = re.sub(r'/{2,}', '/', path)
+        for name, upstream, pattern in self.routes:
+            found = pattern.match(path)
+            if found:
+                return name, upstream, {key: value for key, value in found.groupdict().items() if value is not None}
+        return None, None, {}
+
+    async def record_live(self, upstream: str, path: str, query: str) -> Optional[Any]:
+        if self.live is None:
+            self.live = aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0'})
+        url = LIVE_URLS[upstream] + path + (f'?{query}' if query else '')
+        async with self.live.get(url) as response:
+            if response.status != 200:
+                return None
+            return await response.json() if upstream == 'tmdb' else await response.text()
+
+    async def body(self, name: str, upstream: str, path: str, query: str, args: Dict[str, str]) -> Any:
+        if self.fixtures is not None:
+            fixture = fixture_path(self.fixtures, upstream, re.sub(r'/{2,}', '/', path))
+            if fixture.exists():
+                text = fixture.read_text(encoding='utf-8')
+                return json.loads(text) if fixture.suffix == '.json' else text
+            if self.record:
+                body = await self.record_live(upstream, path, query)
+                if body is not None:
+                    fixture.parent.mkdir(parents=True, exist_ok=True)
+                    fixture.write_text(json.dumps(body) if fixture.suffix == '.json' else body, encoding='utf-8')
+                    return body
+        return self.synthetic.respond(name, args)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        if request.path == '/_stats':
+            return web.json_response(self.stats())
+        if request.path == '/_reset':
+            self.reset()
+            return web.json_response(self.stats())
+
+        name, upstream, args = self.match(request.path)
+        self.requests[name or 'unknown'] += 1
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            delay = max(self.rng.gauss(self.latency, self.jitter), 0) if self.latency or self.jitter else 0
+            if delay:
+                await asyncio.sleep(delay)
+
+            roll = self.rng.random()
+            if roll < self.timeout_rate:
+                self.errors['timeout'] += 1
+                await asyncio.sleep(3600)  # the client's timeout fires first
+            roll -= self.timeout_rate
+            if roll < self.throttle_rate:
+                self.errors['429'] += 1
+                return web.Response(status=429, headers={'Retry-After': str(self.retry_after)})
+            roll -= self.throttle_rate
+            if roll < self.error_rate:
+                self.errors['500'] += 1
+                return web.Response(status=500, text='Internal Server Error')
+
+            if name is None:
+                return web.Response(status=404, text='Not Found')
+            body = await self.body(name, upstream, request.path, request.query_string, args)
+            if isinstance(body, (dict, list)):
+                return web.json_response(body)
+            return web.Response(text=body, content_type='text/html')
+        finally:
+            self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': dict(self.requests),
+            'total': sum(self.requests.values()),
+            'errors': dict(self.errors),
+            'peak_concurrency': self.peak,
+            'active': self.active,
+            'uptime_s': round(time.monotonic() - self.started, 2),
+        }
+
+    def reset(self) -> None:
+        self.requests.clear()
+        self.errors.clear()
+        self.peak = self.active
+        self.started = time.monotonic()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', self.handle)
+        app.router.add_route('HEAD', '/{tail:.*}', self.handle)
+
+        async def close_live(app):
+            if self.live is not None:
+                await self.live.close()
+        app.on_cleanup.append(close_live)
+        return app
+
+# Serve on one or two ports (letterboxd and TMDB on separate ports get separate
+# governor limits, like the real hosts). Returns the runner for cleanup.
+async def serve(upstream: Upstream, host: str = '127.0.0.1', port: int = 8081, tmdb_port: Optional[int] = None) -> web.AppRunner:
+    runner = web.AppRunner(upstream.app(), access_log=None)
+    await runner.setup()
+    for p in filter(None, [port, tmdb_port]):
+        await web.TCPSite(runner, host, p).start()
+    return runner
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for letterboxd.com and TMDB")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--tmdb-port', type=int, default=8082)
+    parser.add_argument('--fixtures', type=Path, help="directory of recorded responses to replay")
+    parser.add_argument('--record', action='store_true', help="fetch fixtures missing from --fixtures from the live sites")
+    parser.add_argument('--latency', type=float, default=0.0, help="mean added latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="standard deviation of the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with a 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of requests answered with a 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="share of requests that never answer")
+    parser.add_argument('--films', type=int, default=300, help="average films per synthetic user")
+    parser.add_argument('--friends', type=int, default=40)
+    parser.add_argument('--reviews', type=int, default=30)
+    args = parser.parse_args()
+
+    if args.record and args.fixtures is None:
+        parser.error("--record needs --fixtures")
+
+    upstream = Upstream(
+        Synthetic(films=args.films, friends=args.friends, reviews=args.reviews),
+        fixtures=args.fixtures, record=args.record, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        timeout_rate=args.timeout_rate,
+    )
+
+    async def run():
+        runner = await serve(upstream, args.host, args.port, args.tmdb_port)
+        print(f"letterboxd stand-in on http://{args.host}:{args.port}, TMDB on http://{args.host}:{args.tmdb_port}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
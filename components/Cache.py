@@ -0,0 +1,49 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Optional
+
+class LRUCache:
+
+    def __init__(self, maxsize: int, ttl: Optional[timedelta] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, timestamp = entry
+        if self.ttl is not None and datetime.now() - timestamp >= self.ttl:
+            del self.entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # timestamp is when the value was scraped, so a value loaded from the db
+    # expires at the same moment its row goes stale
+    def put(self, key: Hashable, value: Any, timestamp: Optional[datetime] = None) -> None:
+        self.entries[key] = (value, timestamp or datetime.now())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+        }
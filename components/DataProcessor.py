@@ -1,9 +1,19 @@
 import pandas as pd
 import numpy as np
 import json
-import requests
+import hashlib
+import aiohttp
+from datetime import datetime
+from functools import lru_cache, wraps
+from itertools import chain, repeat
 from pathlib import Path
-from bs4 import BeautifulSoup
+from components.Session import governor, LETTERBOXD_URL
+from components import Extract, Metrics, Parser
+from database.database import fetch_processed_data, upsert_processed_data
+
+# part of the key for cached results: bump it whenever a change here changes
+# what main() returns, and results computed by the old code are dropped
+ANALYTICS_VERSION = '1'
 
 personal_identity = [
     'Politics and human rights',
@@ -74,24 +84,6 @@ escapist = [
 
 ]
 
-def theme_score(df):
-    score = {
-        'personal_identity': 0,
-        'escapist': 0,
-    }
-    df = df[df['user_rating'] != 0]
-    themes = df.themes.values
-
-    for i in themes:
-        for j in i:
-            if j in personal_identity:
-                score['personal_identity'] += 1 / len(themes)
-                break
-            if j in escapist:
-                score['escapist'] += 1 / len(themes)
-                break
-    return score
-
 def date_diff(df):
     df = df.copy()
     df['date_diff'] = (df['last_watched'] - df['release_date']).dt.days
@@ -110,11 +102,57 @@ def rate_difference(df):
     rate_diff = rated_movies['user_rating'] - rated_movies['rating']
     return rate_diff.var()
 
+def descending(values):
+    # the order Series.sort_values(ascending=False) puts values in, ties included;
+    # reproduced so results with tied counts or ratios come out as they always have
+    return np.arange(len(values))[::-1][values[::-1].argsort()][::-1]
+
+def top_two(counts, values):
+    # the two most common values seen more than once, as value_counts().nlargest(2)
+    # picks them from counts in first-seen order
+    order = descending(counts)
+    order = order[counts[order] > 1][:2]
+    return {values[i]: int(counts[i]) for i in order}
+
+def entropy(counts, max):
+    probs = (np.sort(counts)[::-1] / counts.sum()).tolist()
+    entropy = -sum([i * np.log2(i) for i in probs])
+    return (entropy / np.log2(max))
+
+@lru_cache(maxsize=None)
+def public_csv(name):
+    return pd.read_csv(Path(__file__).resolve().parent.parent / 'public' / name)
+
+# list columns exploded once into Processor.facets
+FACETS = ['genres', 'themes', 'countries', 'spoken_languages', 'nanogenres', 'actors']
+
+def memoized(method):
+    # derived values are computed once per preprocess_df and shared by every analytic
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self.memo:
+            self.memo[key] = method(self, *args, **kwargs)
+        return self.memo[key]
+    return wrapper
+
 class Processor:
     def __init__(self, data, user):
         self.data = data
         self.user = user
         self.df = pd.DataFrame(data)
+        self.profile_html = ''
+        self.profile_header = None
+        self.facets = None
+        self.memo = {}
+
+    async def load_profile(self, session: aiohttp.ClientSession):
+        url = f"{LETTERBOXD_URL}/{self.user}/"
+        async with governor.request(url) as slot:
+            async with session.get(url) as response:
+                slot.observe(response)
+                self.profile_html = await response.text()
+        self.profile_header = await Parser.run(Extract.profile_header, self.profile_html)
     
     def preprocess_df(self):
         df = self.df
@@ -123,31 +161,103 @@ class Processor:
         df['last_watched'] = pd.to_datetime(df['last_watched'], errors='coerce')
         df['release_date'] = pd.to_datetime(df['release_date'], errors='coerce')
         df['release_year'] = df['release_date'].dt.year
-        lang_codes = pd.read_csv(Path(__file__).resolve().parent.parent / 'public' / 'code.csv')
+        lang_codes = public_csv('code.csv')
         df = df.merge(lang_codes, left_on='original_language', right_on='ISO_code', how='left').drop(columns=['ISO_code', 'original_language'])
 
         self.df = df
+        self.memo = {}
+        self.build_facets()
+
+    def build_facets(self):
+        # every list column in one long table, (film, facet, value), in the order
+        # explode() would give: film by film, each list in order. film is the row
+        # position in self.df; values are categories shared across facets, sorted.
+        films, facets, values = [], [], []
+        self.facet_bounds = {}
+        self.facet_missing = {}
+        start = 0
+        for i, facet in enumerate(FACETS):
+            lists = self.df[facet].tolist()
+            lengths = np.fromiter((len(v) if isinstance(v, list) else 0 for v in lists), dtype=np.int64, count=len(lists))
+            films.append(np.repeat(np.arange(len(lists), dtype=np.int32), lengths))
+            facets.append(np.full(lengths.sum(), i, dtype=np.int8))
+            values.extend(chain.from_iterable(v for v in lists if isinstance(v, list)))
+            # a film without any explodes to NaN, which some counts have always included
+            self.facet_missing[facet] = bool((lengths == 0).any())
+            self.facet_bounds[facet] = (start, start + int(lengths.sum()))
+            start += int(lengths.sum())
+
+        self.facets = pd.DataFrame({
+            'film': np.concatenate(films),
+            'facet': pd.Categorical.from_codes(np.concatenate(facets), FACETS),
+            'value': pd.Categorical(values),
+        })
+        self.facet_films = self.facets['film'].to_numpy()
+        self.facet_codes = self.facets['value'].cat.codes.to_numpy()
+        self.facet_categories = self.facets['value'].cat.categories
+
+    @memoized
+    def facet(self, name, rated=False):
+        # (film, value code, categories) for one facet, rows without a value left out.
+        # Scalar columns (director, release_year, Language) come from the frame.
+        if name in self.facet_bounds:
+            start, end = self.facet_bounds[name]
+            films, codes, categories = self.facet_films[start:end], self.facet_codes[start:end], self.facet_categories
+        else:
+            codes, categories = pd.factorize(self.df[name])
+            films = np.arange(len(codes), dtype=np.int32)
+        keep = codes >= 0
+        if rated:
+            keep &= self.rated_mask()[films]
+        return films[keep], codes[keep], categories
+
+    @memoized
+    def facet_values(self, name):
+        # distinct values in first-seen order, as explode().dropna().unique()
+        _, codes, categories = self.facet(name)
+        return categories.take(pd.unique(codes)).tolist()
+
+    @memoized
+    def rated_mask(self):
+        return (self.df['user_rating'] != 0).to_numpy()
+
+    @memoized
+    def rated(self):
+        return self.df[self.rated_mask()]
+
+    def high_rate_ratio(self, name, threshold):
+        # ratings 4 and up over all non-zero ratings per value, for values rated more
+        # than threshold times; best first, ties as DataFrame.sort_values leaves them
+        films, codes, categories = self.facet(name)
+        ratings = self.df['user_rating'].to_numpy()[films]
+        rated = (ratings != 0) & ~np.isnan(ratings)
+        high = np.isin(ratings, [4.0, 4.5, 5])
+        total = np.bincount(codes[rated], minlength=len(categories))
+        high = np.bincount(codes[high], minlength=len(categories))
+
+        # categories are sorted, so code order is the order groupby sorted values in
+        keep = np.flatnonzero(total > threshold)
+        ratio = high[keep] / total[keep]
+        order = descending(ratio)
+        labels = categories.take(keep[order]).tolist()
+        return dict(zip(labels, ratio[order].tolist()))
     
     def basic_info(self):
         df = self.df
-        url = f"https://letterboxd.com/{self.user}/"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        profile_pic = soup.find('div', class_='profile-avatar').select('img')[0]['src']
-        profile_name = soup.find('h1', class_='person-display-name').span.get_text()
+        profile_pic, profile_name = self.profile_header or Extract.profile_header(self.profile_html)
 
         movie_count = df.shape[0]
-        rated_movie_count = df[df['user_rating'] != 0].shape[0]
+        rated_movie_count = self.rated().shape[0]
         liked_movie_count = df[df['is_liked']].shape[0]
         reviewed_movie_count = df[df['is_reviewed']].shape[0]
         top250_movie_count = df[df['stats_rank'] != 0].shape[0]
 
-        languages = df['spoken_languages'].explode().unique()
-        language_count = len(languages) - 1 if 'No Language' in languages else len(languages) 
-        themes_count = len(df['themes'].explode().unique()) - 1
+        # the NaN from films without languages or themes has always been counted
+        languages = self.facet_values('spoken_languages')
+        language_count = len(languages) + self.facet_missing['spoken_languages'] - ('No Language' in languages)
+        themes_count = len(self.facet_values('themes')) + self.facet_missing['themes'] - 1
 
-        countries_explored = list(df['countries'].explode().dropna().unique())
+        countries_explored = self.facet_values('countries')
 
         return {
             'profile_pic': profile_pic,
@@ -183,25 +293,9 @@ class Processor:
     
     def high_rated_genres_themes(self):
 
-        df = self.df
-        def get_data(feature):
-            if feature == "genres":
-                threshold = 1 if df.shape[0] < 50 else 10
-            else:
-                threshold = 5 if df.shape[0] < 50 else 10
-
-            temp_df = df.explode(feature)
-            temp_df = temp_df.groupby([feature, 'user_rating']).size().unstack(fill_value=0)
-            if 0 in temp_df.columns:
-                temp_df = temp_df.drop(columns=[0])
-            temp_df['total'] = temp_df.sum(axis=1)
-            high_rating_columns = [col for col in [4.0, 4.5, 5] if col in temp_df.columns]
-            temp_df['high_rating'] = temp_df[high_rating_columns].sum(axis=1)
-            temp_df['high_rate_ratio'] = temp_df['high_rating'] / temp_df['total']
-            return temp_df[temp_df['total'] > threshold].sort_values(by='high_rate_ratio', ascending=False)['high_rate_ratio'].to_dict()
-        
-        genre_dict = get_data('genres')
-        themes_dict = get_data('themes')
+        small = self.df.shape[0] < 50
+        genre_dict = self.high_rate_ratio('genres', 1 if small else 10)
+        themes_dict = self.high_rate_ratio('themes', 5 if small else 10)
 
         return {
             'high_rated_genres' : genre_dict,
@@ -210,67 +304,75 @@ class Processor:
     
     def monthly_summary(self):
 
-        def most_watched(df, feature):
-            col = df[feature]
-            counts = col.dropna().explode().value_counts()
-            data = counts[counts > 1].nlargest(2)
-            return data.to_dict()
-        
-        data = []
-
         df = self.df
-        for i in df['last_watched'].dt.to_period('M').unique():
-            year = i.year
-            month = i.month
+        # months in the order they first appear in the diary; films without a date
+        # are rated in no month
+        month_codes, months = pd.factorize(df['last_watched'].dt.to_period('M'))
+        dated = self.rated_mask() & (month_codes >= 0)
+        totals = np.bincount(month_codes[dated], minlength=len(months))
+
+        features = {
+            'most_watched_genre': 'genres',
+            'most_watched_country': 'countries',
+            'most_watched_director': 'director',
+            'most_watched_year': 'release_year',
+            'most_watched_theme': 'themes',
+            'most_watched_language': 'spoken_languages',
+            'most_watched_actor': 'actors',
+        }
 
-            filtered_data = df[
-                (df['user_rating'] != 0) &
-                (df['last_watched'].dt.year == year) &
-                (df['last_watched'].dt.month == month)
-            ]
+        # count (month, value) pairs for the whole diary at once, in first-seen order,
+        # then split by month
+        most_watched = {}
+        for key, feature in features.items():
+            films, codes, categories = self.facet(feature, rated=True)
+            codes = codes[dated[films]]
+            films = films[dated[films]]
+            width = max(len(categories), 1)
+            pair_ids, pairs = pd.factorize(month_codes[films].astype(np.int64) * width + codes)
+            counts = np.bincount(pair_ids, minlength=len(pairs))
+
+            order = np.argsort(pairs // width, kind='stable')
+            pair_months = pairs[order] // width
+            labels = categories.take(pairs[order] % width).tolist()
+            counts = counts[order]
+            starts = np.flatnonzero(np.diff(pair_months, prepend=-1))
+            ends = np.append(starts[1:], len(order))
+            most_watched[key] = {pair_months[start]: top_two(counts[start:end], labels[start:end]) for start, end in zip(starts, ends)}
 
-            if filtered_data.shape[0] == 0:
+        data = []
+        for i, period in enumerate(months):
+            if totals[i] == 0:
                 continue
 
-            most_watched_genre = most_watched(filtered_data, 'genres')
-            most_watched_country = most_watched(filtered_data, 'countries')
-            most_watched_language = most_watched(filtered_data, 'spoken_languages')
-            most_watched_director = most_watched(filtered_data, 'director')
-            most_watched_year = most_watched(filtered_data, 'release_year')
-            most_watched_theme = most_watched(filtered_data, 'themes')
-            most_watched_actor = most_watched(filtered_data, 'actors')
-
-            data.append({'time' : f'{year}-{month}',
+            data.append({'time' : f'{period.year}-{period.month}',
                     'data' : {
-                                'total_movies' : filtered_data.shape[0],
-                                'most_watched_genre': most_watched_genre ,
-                                'most_watched_country': most_watched_country,
-                                'most_watched_director': most_watched_director,
-                                'most_watched_year': most_watched_year,
-                                'most_watched_theme': most_watched_theme,
-                                'most_watched_language': most_watched_language,
-                                'most_watched_actor': most_watched_actor,
+                                'total_movies' : int(totals[i]),
+                                'most_watched_genre': most_watched['most_watched_genre'].get(i, {}),
+                                'most_watched_country': most_watched['most_watched_country'].get(i, {}),
+                                'most_watched_director': most_watched['most_watched_director'].get(i, {}),
+                                'most_watched_year': most_watched['most_watched_year'].get(i, {}),
+                                'most_watched_theme': most_watched['most_watched_theme'].get(i, {}),
+                                'most_watched_language': most_watched['most_watched_language'].get(i, {}),
+                                'most_watched_actor': most_watched['most_watched_actor'].get(i, {}),
                     }
             })
         return data
     
+    @memoized
     def diversity_score(self):
-            
-        def entropy(df, column, max):
-            df = df[df['user_rating'] != 0]
-            temp = df[column].explode().value_counts().reset_index()
-            probs = (temp['count'] / temp['count'].sum()).tolist()
-
-            entropy = -sum([i * np.log2(i) for i in probs])
-            return  (entropy / np.log2(max))
-        
-        df = self.df
-        genre_score = entropy(df, 'genres', 20)
-        country_score =  entropy(df, 'countries', 195)
-        themes_score =  entropy(df, 'themes', 120)
-        language_score =  entropy(df, 'spoken_languages', 100)
-        year_score = entropy(df, 'release_year', 136)
-        og_language_score = entropy(df, 'Language', 100)
+
+        def score(column, max):
+            _, codes, categories = self.facet(column, rated=True)
+            counts = np.bincount(codes, minlength=len(categories))
+            return entropy(counts[counts > 0], max)
+
+        genre_score = score('genres', 20)
+        country_score =  score('countries', 195)
+        themes_score =  score('themes', 120)
+        language_score =  score('spoken_languages', 100)
+        year_score = score('release_year', 136)
+        og_language_score = score('Language', 100)
 
         return (
                 (genre_score * 0.15) +
@@ -281,10 +383,10 @@ class Processor:
                 (year_score * 0.2)
                 )
     
+    @memoized
     def obscurity_score(self):
 
-        df = self.df
-        df = df[df['user_rating'] != 0]
+        df = self.rated()
         total_movies = df.shape[0]
         obscure_popularity = df[df['stats_watched'] < 10000].shape[0] / total_movies
         obscure_ratings = df[df['rating'] < 3].shape[0] / total_movies
@@ -302,36 +404,24 @@ class Processor:
     
     def word_cloud(self):
 
-        df = self.df
-        threshold = 3 if df.shape[0] < 50 else 10
-        genre_df = df.explode('nanogenres')
-        genre_df = genre_df.groupby(['nanogenres', 'user_rating']).size().unstack(fill_value=0)
-
-        if 0 in genre_df.columns:
-            genre_df = genre_df.drop(columns=[0])
-
-        genre_df['total'] = genre_df.sum(axis=1)
-        cols = list([col for col in [4.0, 4.5, 5] if col in genre_df.columns])
-        genre_df['high_rating'] = genre_df[cols].sum(axis=1)
-        genre_df['high_rate_ratio'] = genre_df['high_rating'] / genre_df['total']
-
-        return genre_df[genre_df['total'] > threshold].sort_values(by='high_rate_ratio', ascending=False)[:50]['high_rate_ratio'].to_dict()
+        threshold = 3 if self.df.shape[0] < 50 else 10
+        return dict(list(self.high_rate_ratio('nanogenres', threshold).items())[:50])
     
     def achievements(self):
         df = self.df
-        countries = df['countries'].explode().dropna().unique()
+        countries = self.facet_values('countries')
         country_count = len(countries)
-        languages = df['spoken_languages'].explode().dropna().unique()
+        languages = self.facet_values('spoken_languages')
         language_count = len(languages) - 1 if 'No Language' in languages else len(languages) 
-        theme_count = len(df['themes'].explode().dropna().unique())
-        genre_count = len(df['genres'].explode().dropna().unique())
-        director_count = len(df['director'].dropna().unique())
+        theme_count = len(self.facet_values('themes'))
+        genre_count = len(self.facet_values('genres'))
+        director_count = len(self.facet_values('director'))
         reviewed_movie_count = df[df['is_reviewed']].shape[0]
         top250_movie_count = df[df['stats_rank'] != 0].shape[0]
         decade_count = len(((df['release_year'].dropna() // 10) * 10).unique())
         obscure_movies = df[df['stats_watched'] < 1000].shape[0]
 
-        continents = pd.read_csv(Path(__file__).resolve().parent.parent / 'public' / 'continents.csv')
+        continents = public_csv('continents.csv')
         country_to_continent = dict(zip(continents['Country'], continents['Continent']))
 
         unique_continents = {country_to_continent[country] for country in countries if country in country_to_continent}
@@ -403,11 +493,29 @@ class Processor:
 
         return achievements
 
+    def theme_score(self):
+        # each rated film counts for its first theme that is on either list
+        score = {
+            'personal_identity': 0,
+            'escapist': 0,
+        }
+        films, codes, categories = self.facet('themes', rated=True)
+        matches = np.flatnonzero(categories.isin(personal_identity) | categories.isin(escapist))
+        matched = np.isin(codes, matches)
+        films, codes = films[matched], codes[matched]
+        first = np.flatnonzero(np.diff(films, prepend=-1))
+        identity = categories.take(codes[first]).isin(personal_identity)
+
+        # summed one film at a time, as it always has been, so the thresholds see the same floats
+        share = 1 / self.rated().shape[0] if len(first) else 0
+        score['personal_identity'] = sum(repeat(share, int(identity.sum())), 0)
+        score['escapist'] = sum(repeat(share, int((~identity).sum())), 0)
+        return score
+
     def get_user_type(self):
 
-        df = self.df
-        df = df[df['user_rating'] != 0]
-        theme_scores = theme_score(df)
+        df = self.rated()
+        theme_scores = self.theme_score()
         diversity = self.diversity_score()
         obscurity = self.obscurity_score()
         date_difference = date_diff(df)
@@ -436,18 +544,19 @@ class Processor:
         
     
     def main(self):
-        self.preprocess_df()
-        basic_info = self.basic_info()
-        rating_diff = self.df[self.df['user_rating'] != 0]['rating_difference'].values.tolist()
-        log_data = self.log_activity()
-        likewatchdata = self.like_to_watch_movie()
-        genre_theme_data = self.high_rated_genres_themes()
-        monthly_sum = self.monthly_summary()
-        div_score = self.diversity_score()
-        obs_score = self.obscurity_score()
-        wordcloud = self.word_cloud()
-        user_type = self.get_user_type()
-        achievement_list = self.achievements()
+        with Metrics.stage('process'):
+            self.preprocess_df()
+            basic_info = self.basic_info()
+            rating_diff = self.rated()['rating_difference'].values.tolist()
+            log_data = self.log_activity()
+            likewatchdata = self.like_to_watch_movie()
+            genre_theme_data = self.high_rated_genres_themes()
+            monthly_sum = self.monthly_summary()
+            div_score = self.diversity_score()
+            obs_score = self.obscurity_score()
+            wordcloud = self.word_cloud()
+            user_type = self.get_user_type()
+            achievement_list = self.achievements()
 
         return {
             'basic_info': basic_info,
@@ -461,4 +570,24 @@ class Processor:
             'obscurity_score': obs_score,
             'word_cloud': wordcloud,
             'user_type': user_type
-        }
\ No newline at end of file
+        }
+
+def fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+async def process(data, user, session: aiohttp.ClientSession, store: bool = True):
+    # store=False for films the user isn't vouched for (uploads): a stored result is
+    # served to anyone asking for that user with the same films
+    # same films as last time: serve the stored result, no DataFrame and no profile fetch
+    key = fingerprint(data)
+    cached = await fetch_processed_data(user, ANALYTICS_VERSION, key)
+    Metrics.CACHE_LOOKUPS.inc('processed_data', 'hit' if cached is not None else 'miss')
+    if cached is not None:
+        return cached
+
+    processor = Processor(data, user)
+    await processor.load_profile(session)
+    processed_data = processor.main()
+    if store:
+        upsert_processed_data((user, ANALYTICS_VERSION, key, datetime.now().isoformat(), processed_data))
+    return processed_data
@@ -0,0 +1,187 @@
+import asyncio
+import csv
+import io
+import re
+import zipfile
+from typing import List, Optional, Dict, Any, AsyncIterator
+import aiohttp
+from database.database import fetch_uri_names, insert_uri_names, fetch_names_by_title
+from components.MovieScraper import MovieDataScraper, MovieData
+from components.Session import governor
+
+# exports are a few hundred KB even for big accounts, anything far past that isn't one
+MAX_EXPORT_SIZE = 20 * 1024 * 1024
+# per CSV once unzipped, checked before reading so a zip bomb is never inflated
+MAX_CSV_SIZE = 50 * 1024 * 1024
+# the columns user_films reads from each file
+EXPORT_COLUMNS = {
+    'watched.csv': {'Date', 'Name', 'Year', 'Letterboxd URI'},
+    'ratings.csv': {'Name', 'Year', 'Rating'},
+    'diary.csv': {'Date', 'Name', 'Year'},
+    'reviews.csv': {'Name', 'Year'},
+    'likes/films.csv': {'Name', 'Year'},
+}
+
+class ExportError(ValueError):
+    status_code = 400
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+def read_export(data: bytes) -> Dict[str, List[Dict[str, str]]]:
+    if len(data) > MAX_EXPORT_SIZE:
+        raise ExportError("Export is too large")
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ExportError("Not a zip file")
+
+    # exports unzip either flat or into a single letterboxd-<user>-<date>/ folder
+    names = [name for name in archive.namelist() if name.endswith('.csv')]
+    prefix = names[0].split('/')[0] + '/' if names and all('/' in name for name in names) else ''
+    if prefix and not all(name.startswith(prefix) for name in names):
+        prefix = ''
+
+    tables = {}
+    for name in ['profile.csv', 'watched.csv', 'ratings.csv', 'diary.csv', 'reviews.csv', 'likes/films.csv']:
+        try:
+            info = archive.getinfo(prefix + name)
+        except KeyError:
+            tables[name] = []
+            continue
+        if info.file_size > MAX_CSV_SIZE:
+            raise ExportError(f"{name} is too large")
+        try:
+            raw = archive.read(info)
+        except (zipfile.BadZipFile, RuntimeError, NotImplementedError):
+            raise ExportError(f"Can't read {name}")
+        tables[name] = list(csv.DictReader(io.StringIO(raw.decode('utf-8-sig'))))
+
+    if not tables['watched.csv']:
+        raise ExportError("Export has no watched films")
+    for name, columns in EXPORT_COLUMNS.items():
+        if tables[name] and not columns <= tables[name][0].keys():
+            raise ExportError(f"{name} is missing columns")
+    return tables
+
+def user_films(tables: Dict[str, List[Dict[str, str]]]) -> List[Dict[str, Any]]:
+    # films are matched across files by name and year; the Letterboxd URI is only
+    # the film's own link in watched.csv and ratings.csv (diary and review URIs point to the entry)
+    films = {}
+    for row in tables['watched.csv']:
+        films[(row['Name'], row['Year'])] = {
+            'title': row['Name'],
+            'year': row['Year'],
+            'uri': row['Letterboxd URI'],
+            'added': row['Date'],
+            'user_rating': 0,
+            'is_liked': False,
+            'is_reviewed': False,
+            'watches': [],
+            'rewatch': False,
+        }
+
+    for row in tables['ratings.csv']:
+        film = films.get((row['Name'], row['Year']))
+        if film and row.get('Rating'):
+            try:
+                film['user_rating'] = float(row['Rating'])
+            except ValueError:
+                raise ExportError(f"Bad rating {row['Rating']!r} for {row['Name']}")
+    for row in tables['likes/films.csv']:
+        film = films.get((row['Name'], row['Year']))
+        if film:
+            film['is_liked'] = True
+    for row in tables['reviews.csv']:
+        film = films.get((row['Name'], row['Year']))
+        if film:
+            film['is_reviewed'] = True
+    for row in tables['diary.csv']:
+        film = films.get((row['Name'], row['Year']))
+        if film:
+            film['watches'].append(row.get('Watched Date') or row['Date'])
+            film['rewatch'] = film['rewatch'] or row.get('Rewatch') == 'Yes'
+
+    # same shape as the activity page: last logged watch (or the date it was marked
+    # watched), and a rewatch if it was flagged or logged more than once
+    for film in films.values():
+        film['last_watched'] = max(film['watches']) if film['watches'] else film['added']
+        film['is_rewatched'] = film['rewatch'] or len(film['watches']) > 1
+
+    # newest first, like the /films/ pages
+    return sorted(films.values(), key=lambda film: film['added'], reverse=True)
+
+class ExportImporter:
+
+    def __init__(self, user, session: aiohttp.ClientSession):
+        self.user = user
+        self.session = session
+        self.scraper = MovieDataScraper(user, session)
+
+    async def resolve_uri(self, uri: str) -> Optional[str]:
+        # boxd.it short links redirect to https://letterboxd.com/film/<slug>/
+        try:
+            async with governor.request(uri) as slot:
+                async with self.session.get(uri, allow_redirects=False) as response:
+                    slot.observe(response)
+                    location = response.headers.get('Location', '')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Failed to resolve {uri}: {e}")
+            return None
+
+        match = re.search(r"/film/([^/]+)/", location)
+        return match.group(1) if match else None
+
+    async def resolve_names(self, films: List[Dict[str, Any]]) -> None:
+        # known URIs first, then a unique title + year match in staticData,
+        # and only what's left costs a request to boxd.it
+        uris = await fetch_uri_names([film['uri'] for film in films])
+        titles = await fetch_names_by_title([(film['title'], film['year']) for film in films if film['uri'] not in uris])
+
+        missing = []
+        for film in films:
+            film['slug'] = uris.get(film['uri']) or titles.get((film['title'], film['year']))
+            if film['slug'] is None:
+                missing.append(film)
+
+        resolved = await asyncio.gather(*(self.resolve_uri(film['uri']) for film in missing))
+        for film, slug in zip(missing, resolved):
+            film['slug'] = slug
+
+        # only what boxd.it answered is shared: a title match rests on the uploaded
+        # CSV pairing that URI with that name, which nothing vouches for
+        insert_uri_names([(film['uri'], film['slug']) for film in missing if film['slug']])
+
+    async def import_pages(self, data: bytes, page_size: int = 72) -> AsyncIterator[List['MovieData']]:
+        tables = await asyncio.to_thread(read_export, data)
+        if self.user is None:
+            profile = tables['profile.csv']
+            self.user = self.scraper.user = profile[0].get('Username') if profile else None
+        if not self.user:
+            raise ExportError("Export has no username")
+
+        films = user_films(tables)
+        await self.resolve_names(films)
+        films = [film for film in films if film['slug']]
+
+        # only film-level data goes through the scraper, and only on a cache miss.
+        # Nothing is written per user: uploads aren't authenticated, so they must
+        # not touch the scrape snapshot that /movies-data builds on
+        for i in range(0, len(films), page_size):
+            page = films[i:i + page_size]
+            page_results = await self.scraper.compile_page(
+                self.session,
+                [f"/film/{film['slug']}/" for film in page],
+                [film['is_reviewed'] for film in page],
+                [film['is_liked'] for film in page],
+                [film['user_rating'] for film in page],
+                activities=[(film['last_watched'], film['is_rewatched']) for film in page],
+            )
+            yield self.scraper.validate(page_results)
+
+    async def import_export(self, data: bytes) -> List['MovieData']:
+        all_movie_data = []
+        async for page_data in self.import_pages(data):
+            all_movie_data.extend(page_data)
+        return all_movie_data
@@ -0,0 +1,245 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import lxml.html
+from lxml import etree
+
+# Targeted extraction over lxml: each function parses the page once with the C
+# parser and pulls only the nodes it needs with XPath, instead of building a
+# BeautifulSoup tree and walking it with find_all. Results are the same as the
+# BeautifulSoup versions they replace.
+
+# a failed fetch (None) raises like BeautifulSoup(None) did, so the film is
+# dropped instead of being cached with empty values
+def parse(html: str) -> etree._Element:
+    if html is None:
+        raise TypeError("no page to parse")
+    if not html.strip():
+        return lxml.html.document_fromstring('<html></html>')
+    return lxml.html.document_fromstring(html)
+
+# matches elements carrying a class token, like BeautifulSoup's class_="token"
+def has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+# matches elements whose whole class attribute is the given string, like
+# BeautifulSoup's class_="token other-token"
+def class_is(value: str) -> str:
+    return f"normalize-space(@class)='{value}'"
+
+def first(nodes: List[Any]) -> Optional[Any]:
+    return nodes[0] if nodes else None
+
+def text(node: etree._Element) -> str:
+    return node.text_content()
+
+# pagination
+
+def page_count(html: str) -> int:
+    pages = parse(html).xpath(f"//li[{has_class('paginate-page')}]")
+    try:
+        return int(text(pages[-1]))
+    except (IndexError, ValueError):
+        return 1
+
+# /{user}/films/ pages
+
+def user_rating(li: etree._Element) -> float:
+    rating = first(li.xpath(f".//span[{has_class('rating')}]"))
+    if rating is None:
+        return 0
+    match = re.search(r"rated-(\d+)", rating.get('class').split()[-1])
+    return int(match.group(1)) / 2
+
+def movie_links(html: str) -> Tuple[List[str], List[bool], List[bool], List[float]]:
+    titles = []
+    user_ratings = []
+    liked = []
+    reviews = []
+
+    for li in parse(html).xpath(f"//li[{has_class('poster-container')}]"):
+        poster_div = first(li.xpath(f".//div[{has_class('poster')}]"))
+        if poster_div is not None:
+            link = poster_div.get('data-target-link')
+            if link:
+                titles.append(link)
+
+        user_ratings.append(user_rating(li))
+        liked.append(bool(li.xpath(f".//span[{class_is('like liked-micro has-icon icon-liked icon-16')}]")))
+        reviews.append(bool(li.xpath(f".//a[{class_is('review-micro has-icon icon-review tooltip')}]")))
+
+    return titles, reviews, liked, user_ratings
+
+def movie_titles(html: str) -> Tuple[List[Optional[str]], List[Optional[str]], List[float]]:
+    links = []
+    user_ratings = []
+    titles = []
+
+    for li in parse(html).xpath(f"//li[{has_class('poster-container')}]"):
+        poster_div = first(li.xpath(f".//div[{has_class('poster')}]"))
+        if poster_div is not None:
+            links.append(poster_div.get('data-target-link') or None)
+            titles.append(poster_div.xpath(".//img")[0].get('alt') or None)
+
+        user_ratings.append(user_rating(li))
+
+    return links, titles, user_ratings
+
+# /{user}/film/{slug}/activity/
+
+def watch_activity(html: str) -> Tuple[Optional[str], bool]:
+    words_to_check = {"watched", "watched,", "reviewed", "reviewed,", "rewatched", "rewatched,"}
+    rewatch_words = {"rewatched", "rewatched,"}
+    results = []
+    is_rewatch = False
+
+    for activity in parse(html).xpath(f"//*[{class_is('activity-row -basic')}]"):
+        words = text(activity).lower().split()
+        if any(word in words for word in words_to_check):
+            is_rewatch = is_rewatch or any(word in words for word in rewatch_words)
+            date_element = first(activity.xpath(f".//span[{has_class('nobr')}]"))
+            if date_element is not None:
+                date = datetime.strptime(text(date_element), "%b %d, %Y")
+            else:
+                date = activity.xpath(".//time")[0].get('datetime')
+                date = datetime.fromisoformat(date.replace("Z", "+00:00"))
+            results.append(date.strftime("%Y-%m-%d"))
+
+    if not results:
+        return None, False
+    return results[0], is_rewatch or len(results) > 1
+
+# /{user}/films/diary/ pages, newest entry first
+
+def diary_entries(html: str) -> List[Tuple[str, str, bool]]:
+    entries = []
+    for row in parse(html).xpath(f"//tr[{has_class('diary-entry-row')}]"):
+        day = first(row.xpath(f".//td[{has_class('td-day')}]//a/@href"))
+        date = re.search(r"/for/(\d{4})/(\d{2})/(\d{2})/", day or '')
+        slug = first(row.xpath(".//*[@data-film-slug]/@data-film-slug | .//*[@data-item-slug]/@data-item-slug"))
+        if slug is None:
+            link = first(row.xpath(f".//td[{has_class('td-film-details')}]//h3//a/@href")) or ''
+            parts = link.strip('/').split('/')
+            slug = parts[parts.index('film') + 1] if 'film' in parts[:-1] else None
+        if date is None or slug is None:
+            continue
+
+        rewatch = row.xpath(f".//td[{has_class('td-rewatch')}][not({has_class('icon-status-off')})]")
+        entries.append((slug, '-'.join(date.groups()), bool(rewatch)))
+    return entries
+
+# /csi/film/{slug}/stats/ and /csi/film/{slug}/rating-histogram/
+
+def stats(html: str) -> Dict[str, int]:
+    root = parse(html)
+    result = {}
+    for tag in ['icon-watched', 'icon-liked', 'icon-top250']:
+        result[tag] = 0
+        link = first(root.xpath(f"//a[{has_class(tag)}]"))
+        if link is not None:
+            match = re.search(r"\d{1,3}(?:,\d{3})*(?=\s)", link.get('title'))
+            if match:
+                result[tag] = int(match.group(0).replace(",", ""))
+    return result
+
+def average_rating(html: str) -> Dict[str, Any]:
+    root = parse(html)
+    result = {}
+
+    item = first(root.xpath(f"//a[{has_class('display-rating')}]"))
+    if item is not None:
+        match = re.search(r"(\d+\.\d+)\s*based on\s*(\d{1,3}(?:,\d{3})*)\s*ratings", item.get('title'))
+        if match:
+            result['rating'] = float(match.group(1))
+            result['count'] = int(match.group(2).replace(",", ""))
+        return result
+
+    total_count = 0
+    total_weighted_sum = 0
+    for i, bar in enumerate(root.xpath(f"//li[{has_class('rating-histogram-bar')}]")):
+        link = first(bar.xpath(".//a"))
+        if link is not None:
+            parts = link.get("title").split(' ')
+            count = int(re.match(r'^\d+', parts[0]).group()) if re.match(r'^\d+', parts[0]) else None
+            total_count += count
+            total_weighted_sum += count * (i + 1) / 2
+
+    result['rating'] = round(total_weighted_sum / total_count, 2) if total_count > 0 else 0
+    result['count'] = total_count
+    return result
+
+# /film/{slug}/ and /film/{slug}/nanogenres/
+
+def metadata(html: str) -> Tuple[str, List[str], List[str], Optional[str]]:
+    root = parse(html)
+
+    director = first(root.xpath(f"//div[@id='tab-crew']//a[{has_class('text-slug')}]"))
+    dir = text(director) if director is not None else ""
+
+    cast_list = first(root.xpath(f"//div[{has_class('cast-list')}]"))
+    actors = [text(a) for a in cast_list.xpath(".//a")[:3]] if cast_list is not None else []
+
+    genre_divs = root.xpath("(//div[@id='tab-genres'])[1]//div")
+    themes = [text(a) for a in genre_divs[1].xpath(".//a")[:-1]] if len(genre_divs) > 1 else []
+
+    tmdb_id = None
+    element = first(root.xpath(f"//*[{class_is('micro-button track-event')}][@data-track-action='TMDb']"))
+    if element is not None:
+        tmdb_id_match = re.search(r'/movie/(\d+)', element.get('href') or '')
+        tmdb_id = tmdb_id_match.group(1) if tmdb_id_match else None
+
+    return dir, actors, themes, tmdb_id
+
+def nanogenres(html: str) -> List[str]:
+    titles = parse(html).xpath(f"//h2[{has_class('title')}]")
+    return list(set(name.strip() for title in titles for name in text(title).strip().split(",")))
+
+# profile pages
+
+def profile_stats(html: str) -> Tuple[int, int, str]:
+    root = parse(html)
+    stats = first(root.xpath(f"//div[{class_is('profile-stats js-profile-stats')}]"))
+    display_name = first(root.xpath(f"//h1[{has_class('person-display-name')}]"))
+    if stats is None or display_name is None:
+        raise AttributeError("profile not found")
+
+    def count(h4, kind):
+        link = h4.xpath(".//a")[0]
+        if kind not in link.get('href'):
+            return 0
+        return int(text(link.xpath(f".//span[{has_class('value')}]")[0]))
+
+    h = stats.xpath(".//h4")
+    return count(h[-1], "followers"), count(h[-2], "following"), text(display_name)
+
+def profile_header(html: str) -> Tuple[str, str]:
+    root = parse(html)
+    avatar = first(root.xpath(f"//div[{has_class('profile-avatar')}]"))
+    display_name = first(root.xpath(f"//h1[{has_class('person-display-name')}]"))
+    if avatar is None or display_name is None:
+        raise AttributeError("profile not found")
+    return avatar.xpath(".//img")[0].get('src'), text(display_name.xpath(".//span")[0])
+
+def friend_list(html: str) -> Tuple[List[str], List[str], List[Optional[str]]]:
+    names = []
+    urls = []
+    pics = []
+    for person in parse(html).xpath(f"//td[{has_class('table-person')}]"):
+        img = person.xpath(".//img")[0]
+        names.append(img.get('alt'))
+        pics.append(img.get('src') or None)
+        urls.append(person.xpath(f".//a[{has_class('avatar')}]")[0].get('href'))
+    return names, urls, pics
+
+# reviews
+
+def review_links(html: str) -> List[str]:
+    return [li.xpath(".//a")[0].get("href") for li in parse(html).xpath(f"//li[{has_class('film-detail')}]")]
+
+def review_text(html: str) -> str:
+    review = parse(html).xpath(f"//div[{has_class('review')}]")[0]
+    paragraphs = review.xpath(".//p")
+    return ' '.join(' '.join(s.strip() for s in p.itertext() if s.strip()) for p in paragraphs)
+
+def likers(html: str) -> List[str]:
+    return [a.get("href") for a in parse(html).xpath(f"//a[{has_class('name')}]")]
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+import aiohttp
+from components import Metrics
+
+# how far above its configured rate a host's token bucket may climb. 1 keeps
+# the configured rates as hard limits; raising it is opt-in, for hosts known
+# to take more than that without throttling
+RATE_CEILING = float(os.getenv('GOVERNOR_RATE_CEILING', 1))
+
+# Per-host admission control shared by every scraper:
+#   - a token bucket caps the request rate (burst tokens). With RATE_CEILING
+#     above 1 the rate is AIMD too: it starts at the configured rate, which is
+#     also its floor, grows by that much per second of fast successes up to
+#     RATE_CEILING times it, and is halved on 429/5xx/errors or when latency
+#     goes over target
+#   - an AIMD window caps concurrency: +1 slot per window of fast successes,
+#     halved on the same signals
+#   - a 429 with Retry-After blocks the host until the given time
+class HostGovernor:
+
+    def __init__(self, rate: float, burst: int, max_concurrency: int, min_concurrency: int = 1,
+                 target_latency: float = 2.0, cooldown: float = 1.0, ceiling: float = RATE_CEILING):
+        self.rate = rate
+        self.min_rate = rate
+        self.max_rate = rate * max(ceiling, 1)
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.limit = float(max(min_concurrency, max_concurrency // 2))
+        self.active = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = asyncio.Condition()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.active < int(self.limit) and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.active += 1
+                    return
+
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = None  # woken up by a release
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    # bookkeeping is synchronous so it still happens when the request was cancelled,
+    # only waking up the waiters is deferred
+    def release(self, latency: float, failed: bool, retry_after: Optional[float]) -> None:
+        self.active -= 1
+        now = time.monotonic()
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+
+        if failed or latency > self.target_latency:
+            # one decrease per cooldown so a burst of failures doesn't collapse the window to 1
+            if now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.last_decrease = now
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            # rate successes a second, so the rate goes up by min_rate every second
+            self.rate = min(self.max_rate, self.rate + self.min_rate / self.rate)
+        asyncio.ensure_future(self._wake())
+
+    async def _wake(self) -> None:
+        async with self.condition:
+            self.condition.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'rate': round(self.rate, 2),
+            'limit': round(self.limit, 2),
+            'active': self.active,
+            'tokens': round(self.tokens, 2),
+            'blocked_for': round(max(self.blocked_until - time.monotonic(), 0), 2),
+        }
+
+def retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+class Slot:
+
+    def __init__(self, host: HostGovernor, url: str):
+        self.host = host
+        self.pattern = Metrics.url_pattern(url)
+        self.status = None
+        self.retry_after = None
+        self.started = 0.0
+
+    def observe(self, response: aiohttp.ClientResponse) -> None:
+        self.status = response.status
+        if response.status == 429 or response.status == 503:
+            self.retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+
+    async def __aenter__(self) -> 'Slot':
+        queued = time.monotonic()
+        await self.host.acquire()
+        self.started = time.monotonic()
+        Metrics.observe_stage('throttle', self.started - queued)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        latency = time.monotonic() - self.started
+        failed = exc_type is not None or self.status is None or self.status == 429 or self.status >= 500
+        self.host.release(latency, failed, self.retry_after)
+
+        Metrics.UPSTREAM_REQUESTS.inc(self.pattern, self.status if self.status is not None else 'error')
+        Metrics.UPSTREAM_LATENCY.observe(latency, self.pattern)
+        Metrics.observe_stage('network', latency)
+
+class RateGovernor:
+
+    def __init__(self, policies: Dict[str, Tuple[float, int, int]], default: Tuple[float, int, int]):
+        self.policies = policies
+        self.default = default
+        self.hosts: Dict[str, HostGovernor] = {}
+        self.loop = None
+
+    def host(self, url: str) -> HostGovernor:
+        # asyncio primitives belong to one loop; start over if we are running on a new one
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.hosts = {}
+            self.loop = loop
+
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            rate, burst, max_concurrency = self.policies.get(host, self.default)
+            self.hosts[host] = HostGovernor(rate, burst, max_concurrency)
+        return self.hosts[host]
+
+    def request(self, url: str) -> Slot:
+        return Slot(self.host(url), url)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {host: governor.stats() for host, governor in self.hosts.items()}
@@ -0,0 +1,228 @@
+import bisect
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+# Process-wide counters and histograms, rendered in the Prometheus text format
+# by the /metrics endpoint. Everything is in memory and starts from zero when the
+# process does; with several gunicorn workers each one reports its own numbers.
+
+# the endpoint the current request came in on; contextvars follow it into the
+# tasks it spawns. Refresher workers and the sweeper run outside any request.
+endpoint = contextvars.ContextVar('endpoint', default='background')
+
+# seconds; scraping a big account or processing 20k films takes tens of them
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, values: Sequence[str]) -> Tuple[str, ...]:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {values}")
+        return tuple(str(value) for value in values)
+
+    def label_text(self, values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labels, values)) + ([extra] if extra else [])
+        if not pairs:
+            return ''
+        escaped = [(name, value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')) for name, value in pairs]
+        return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        return '\n'.join(lines + self.samples())
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{self.label_text(key)} {value:g}" for key, value in values]
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: counts per bucket (+Inf last), sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self.values[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self.values.items())
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f"{self.name}_bucket{self.label_text(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(key)} {total:g}")
+            lines.append(f"{self.name}_count{self.label_text(key)} {cumulative}")
+        return lines
+
+class Collected(Metric):
+    # read when /metrics is rendered from whatever keeps the numbers, e.g. LRUCache.stats();
+    # collect returns label values -> value
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], type: str,
+                 collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, help, labels)
+        self.type = type
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        values = sorted((self.key(key), value) for key, value in self.collect().items())
+        return [f"{self.name}{self.label_text(key)} {value:g}" for key, value in values]
+
+registry: List[Metric] = []
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+# upstream URLs are labelled by route, not by user or film, to keep the series bounded
+URL_PATTERNS = [(label, re.compile(pattern)) for label, pattern in [
+    ('/3/movie/{id}', r'^/3/movie/\d+$'),
+    ('/csi/film/{slug}/stats/', r'^/csi/film/[^/]+/stats/$'),
+    ('/csi/film/{slug}/rating-histogram/', r'^/csi/film/[^/]+/rating-histogram/$'),
+    ('/film/{slug}/nanogenres/', r'^/film/[^/]+/nanogenres/$'),
+    ('/film/{slug}/', r'^/film/[^/]+/?$'),
+    ('/{user}/films/', r'^/[^/]+/films/(?:page/\d+/)?$'),
+    ('/{user}/films/diary/', r'^/[^/]+/films/diary/(?:page/\d+/)?$'),
+    ('/{user}/films/reviews/', r'^/[^/]+/films/reviews/(?:page/\d+/)?$'),
+    ('/{user}/followers/', r'^/[^/]+/followers/(?:page/\d+/)?$'),
+    ('/{user}/following/', r'^/[^/]+/following/(?:page/\d+/)?$'),
+    ('/{user}/film/{slug}/activity/', r'^/[^/]+/film/[^/]+/activity/$'),
+    ('/{user}/film/{slug}/likes/', r'^/[^/]+/film/[^/]+/(?:\d+/)?likes/?$'),
+    ('/{user}/film/{slug}/', r'^/[^/]+/film/[^/]+/(?:\d+/)?$'),
+    ('/{user}/', r'^/[^/]+/$'),
+]]
+
+def url_pattern(url: str) -> str:
+    parts = urlsplit(url)
+    if parts.netloc == 'boxd.it':
+        return 'boxd.it/{id}'
+    path = re.sub(r'/{2,}', '/', parts.path)
+    for label, pattern in URL_PATTERNS:
+        if pattern.match(path):
+            return label
+    return 'other'
+
+UPSTREAM_REQUESTS = Counter(
+    'unboxd_upstream_requests_total', "Requests to Letterboxd, TMDB and boxd.it by route and response status ('error' when none came back)",
+    ['pattern', 'status'])
+UPSTREAM_LATENCY = Histogram(
+    'unboxd_upstream_request_duration_seconds', "Time from sending an upstream request to reading its body, by route",
+    ['pattern'])
+FETCH_RETRIES = Counter(
+    'unboxd_fetch_retries_total', "Upstream fetches retried after an error or a 429, by route",
+    ['pattern'])
+FETCH_FAILURES = Counter(
+    'unboxd_fetch_failures_total', "Upstream fetches that gave up and returned nothing, by route",
+    ['pattern'])
+CACHE_LOOKUPS = Counter(
+    'unboxd_cache_lookups_total', "Cache lookups by table and result: memory (in-memory LRU, SQLite not queried), hit, stale or miss in SQLite",
+    ['table', 'result'])
+STAGE_SECONDS = Histogram(
+    'unboxd_stage_duration_seconds',
+    "Time per unit of work by endpoint and stage: network (request in flight), throttle (waiting for the rate governor), "
+    "parse (HTML extraction), process (Processor.main), rank (similarity and recommendations). "
+    "Concurrent work overlaps, so sums can exceed wall time",
+    ['endpoint', 'stage'])
+HTTP_REQUESTS = Counter(
+    'unboxd_http_requests_total', "Requests served by endpoint and status",
+    ['endpoint', 'status'])
+HTTP_LATENCY = Histogram(
+    'unboxd_http_request_duration_seconds', "Time to serve a request by endpoint, until the last byte of the body",
+    ['endpoint'])
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, endpoint.get(), stage)
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+class MetricsMiddleware:
+    # plain ASGI so the endpoint label is set before the route runs and stays
+    # set while a streaming body is produced
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def route(scope) -> str:
+        from starlette.routing import Match
+        for route in scope['app'].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return 'other'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        name = self.route(scope)
+        token = endpoint.set(name)
+        status = [500]
+
+        async def send_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            HTTP_LATENCY.observe(time.perf_counter() - start, name)
+            HTTP_REQUESTS.inc(name, status[0])
+            endpoint.reset(token)
@@ -1,22 +1,43 @@
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-import re
 import json
-import requests
 from pydantic import BaseModel
-from typing import List, Optional, Tuple, Dict, Any, Union
-from datetime import datetime
+from typing import List, Optional, Tuple, Dict, Any, Union, AsyncIterator
+from datetime import datetime, timedelta
 from tqdm.asyncio import tqdm
 from dotenv import load_dotenv
 import os
-from database.database import (create_static_table, insert_into_static, 
-                      fetch_static_row, create_semistatic_table, does_data_exists, 
-                      fetch_semistatic_row, insert_into_semistatic, 
-                      update_semistatic)
+from database.database import (fetch_static_rows, fetch_semistatic_rows,
+                      insert_static_rows, upsert_semistatic_rows,
+                      fetch_snapshot, upsert_snapshot)
+from components.Session import governor, LETTERBOXD_URL, TMDB_URL
+from components import Extract, Metrics, Parser
+from components.Cache import LRUCache
+from components.SingleFlight import SingleFlight
+from components.Refresher import refresher, SWEEP
 
 load_dotenv()
 
+# a snapshot whose last full scan is older than this is thrown away and the whole
+# film list is rescanned, which also picks up removed films and edited ratings.
+# Incremental refreshes keep the time of the full scan they started from.
+SNAPSHOT_MAX_AGE = 5
+
+# where last_watched/is_rewatched come from:
+#   activity - one /{user}/film/{slug}/activity/ request per film
+#   diary    - the user's diary listing (~50 entries a page), read once per scrape;
+#              films with no diary entry fall back to their activity page
+#   auto     - diary when at least DIARY_MIN_FILMS films need it, activity otherwise
+WATCH_ACTIVITY_MODE = os.getenv('WATCH_ACTIVITY_MODE', 'auto')
+DIARY_MIN_FILMS = int(os.getenv('DIARY_MIN_FILMS', 50))
+FILMS_PER_PAGE = 72
+
+# every SWEEP_INTERVAL seconds the SWEEP_SIZE most requested films are refreshed
+# in the background once their stats are within SWEEP_AHEAD of going stale
+SWEEP_INTERVAL = int(os.getenv('SWEEP_INTERVAL', 3600))
+SWEEP_SIZE = int(os.getenv('SWEEP_SIZE', 500))
+SWEEP_AHEAD = timedelta(days=1)
+
 class UserMovieCountError(ValueError):
     status_code = 400
 
@@ -47,14 +68,24 @@ class MovieData(BaseModel):
     user_rating: float = 0
     is_liked: bool = False
     is_reviewed: bool = False
+    slug: Optional[str] = None
 
 class MovieDataScraper:
 
-    def __init__(self, user):
+    # decoded film records shared by every request, keyed by slug
+    static_cache = LRUCache(maxsize=10000)
+    semistatic_cache = LRUCache(maxsize=10000, ttl=timedelta(days=5))
+    film_flights = SingleFlight()
+
+    def __init__(self, user, session: aiohttp.ClientSession):
         self.user = user
+        self.session = session
         self.TMDB_KEY = os.getenv('TMDB_KEY')
-        create_static_table()
-        create_semistatic_table()
+        self.failed_pages = 0
+        # films dropped or missing their TMDB data; a snapshot without them would
+        # hide them from incremental refreshes
+        self.failed_films = 0
+        self.diary: Optional[asyncio.Task] = None
 
     async def fetch(self, session: aiohttp.ClientSession, url: str) -> Union[dict, str, None]:
         max_attempts = 3
@@ -64,12 +95,16 @@ class MovieDataScraper:
 
         for attempt in range(max_attempts):
             try:
-                async with session.get(url,timeout=aiohttp.ClientTimeout(total=timeout)) as response:
-                    # print(f"Fetching {url} (Attempt {attempt + 1}/{max_attempts})")
-                    if 'api.themoviedb.org' in url:
-                        return await response.json()
-                    else:
-                        return await response.text()
+                async with governor.request(url) as slot:
+                    async with session.get(url,timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                        # print(f"Fetching {url} (Attempt {attempt + 1}/{max_attempts})")
+                        slot.observe(response)
+                        if response.status == 429:
+                            response.raise_for_status()  # retried once the governor lets the host through
+                        if url.startswith(TMDB_URL):
+                            return await response.json()
+                        else:
+                            return await response.text()
             except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 if isinstance(e, aiohttp.ClientError):
                     print(f"Client error while fetching {url}: {e}")
@@ -79,6 +114,7 @@ class MovieDataScraper:
                 if attempt < max_attempts - 1:
                     wait_time = min(base_wait_time * (2 ** attempt), max_wait_time)
                     print(f"Retrying in {wait_time} seconds...")
+                    Metrics.FETCH_RETRIES.inc(Metrics.url_pattern(url))
                     await asyncio.sleep(wait_time)
                 else:
                     print(f"Max attempts reached. Fetch failed for {url}")
@@ -86,69 +122,53 @@ class MovieDataScraper:
                 print(f"An error occurred while fetching {url}: {e}")
                 break  # Exit the retry loop for unexpected errors
 
+        Metrics.FETCH_FAILURES.inc(Metrics.url_pattern(url))
         return None
 
     async def extract_movie_links(self, html:str) -> Tuple[List[str], List[bool], List[bool], List[Optional[float]]]:
-        titles = []
-        user_ratings = []
-        liked = []
-        reviews = []
-        soup = BeautifulSoup(html, 'lxml')
-
-        for li in soup.find_all('li', class_="poster-container"):
-            poster_div = li.find('div', class_="poster")
-            if poster_div:
-                link = poster_div.get('data-target-link')
-                if link:
-                    titles.append(link)
-
-            rating = li.find('span', class_='rating')
-            if rating:
-                match = re.search(r"rated-(\d+)", rating['class'][-1])
-                number = int(match.group(1)) / 2
-                user_ratings.append(number)
-            else:
-                user_ratings.append(0)
-
-            is_liked = li.find('span', class_='like liked-micro has-icon icon-liked icon-16')
-            liked.append(True if is_liked else False)
-            
-            is_reviewed = li.find('a', class_='review-micro has-icon icon-review tooltip')
-            reviews.append(True if is_reviewed else False)
-
-        return titles, reviews, liked, user_ratings
+        return await Parser.run(Extract.movie_links, html)
 
     async def extract_watch_activity(self, session: aiohttp.ClientSession, name: str) -> Tuple[Optional[str], bool]:
 
-        url = f"https://letterboxd.com/{self.user}/film/{name}/activity/"
+        url = f"{LETTERBOXD_URL}/{self.user}/film/{name}/activity/"
         html= await self.fetch(session, url)    
-
-        soup = BeautifulSoup(html, 'lxml')
-        words_to_check = {"watched", "watched,", "reviewed", "reviewed,", "rewatched", "rewatched,"}
-        rewatch_words = {"rewatched", "rewatched,"}
-        activities = soup.find_all(class_="activity-row -basic")
-        results = []
-        is_rewatch = False
-
-        for activity in activities:
-            text = activity.get_text().lower()
-            if any(word in text.split() for word in words_to_check):
-                is_rewatch = is_rewatch or any(word in text.split() for word in rewatch_words)
-                date_element = activity.find("span", class_="nobr")
-                if date_element:
-                    date = date_element.get_text()
-                    date = datetime.strptime(date, "%b %d, %Y")
+        return await Parser.run(Extract.watch_activity, html)
+
+    def use_diary(self, film_count: int) -> bool:
+        if WATCH_ACTIVITY_MODE == 'auto':
+            return film_count >= DIARY_MIN_FILMS
+        return WATCH_ACTIVITY_MODE == 'diary'
+
+    async def extract_diary(self, session: aiohttp.ClientSession) -> Dict[str, Tuple[str, bool]]:
+        first_page = await self.fetch(session, f"{LETTERBOXD_URL}/{self.user}/films/diary/")
+        if not first_page:
+            return {}
+        pages = await self.page_nums(first_page)
+        urls = [f"{LETTERBOXD_URL}/{self.user}/films/diary/page/{i}/" for i in range(2, pages + 1)]
+        htmls = [first_page] + await asyncio.gather(*(self.fetch(session, url) for url in urls))
+
+        # entries are newest first: the first one is the last watch, any second one is a rewatch
+        activity = {}
+        for html in htmls:
+            if not html:
+                continue  # films on a missing page fall back to their activity page
+            for name, date, rewatch in await Parser.run(Extract.diary_entries, html):
+                if name in activity:
+                    activity[name] = (activity[name][0], True)
                 else:
-                    date = activity.find('time')['datetime']
-                    date = datetime.fromisoformat(date.replace("Z", "+00:00"))
-                results.append(date.strftime("%Y-%m-%d"))
-        if not results:
-            return None, False
-        is_rewatch = is_rewatch | (len(results) > 1)
-        return results[0], is_rewatch
+                    activity[name] = (date, rewatch)
+        return activity
+
+    async def watch_activity(self, session: aiohttp.ClientSession, name: str) -> Tuple[Optional[str], bool]:
+        if self.diary is not None:
+            # shielded: one film being cancelled must not cancel the diary for the rest
+            diary = await asyncio.shield(self.diary)
+            if name in diary:
+                return diary[name]
+        return await self.extract_watch_activity(session, name)
          
     async def fetch_tmdb_details(self, movie_id: int, session: aiohttp.ClientSession) -> Optional[Dict[str, Any]]:    
-        url = f"https://api.themoviedb.org/3/movie/{movie_id}?api_key={self.TMDB_KEY}"
+        url = f"{TMDB_URL}/3/movie/{movie_id}?api_key={self.TMDB_KEY}"
         tmdb_data = await self.fetch(session, url)
         if tmdb_data:
             if 'id' in tmdb_data:
@@ -168,177 +188,189 @@ class MovieDataScraper:
         
     async def extract_stats(self, session: aiohttp.ClientSession, name: str) -> Dict[str, int]:
 
-        url = f"https://letterboxd.com/csi/film/{name}/stats/"
+        url = f"{LETTERBOXD_URL}/csi/film/{name}/stats/"
         page = await self.fetch(session, url)
-        soup = BeautifulSoup(page, "lxml")
-
-        tags = ['icon-watched', 'icon-liked', 'icon-top250']
-        result = {tag:0 for tag in tags}
-
-        for tag in tags:
-            if soup.find('a', class_=tag):
-                text = soup.find('a', class_=tag)['title']
-                match = re.search(r"\d{1,3}(?:,\d{3})*(?=\s)", text)
-                if match:
-                    result[tag] = int(match.group(0).replace(",", ""))
-        return result
+        return await Parser.run(Extract.stats, page)
     
     async def extract_average_rating(self, session: aiohttp.ClientSession, name: str) -> Dict[str, Any]:
 
-        url = f"https://letterboxd.com//csi/film/{name}/rating-histogram/"
+        url = f"{LETTERBOXD_URL}/csi/film/{name}/rating-histogram/"
         page = await self.fetch(session, url)
-        soup = BeautifulSoup(page, "lxml")
-
-        result = {}
-
-        item = soup.find('a', class_='display-rating')
-        if item:
-            text = item['title']
-            match = re.search(r"(\d+\.\d+)\s*based on\s*(\d{1,3}(?:,\d{3})*)\s*ratings", text)
-            
-            if match:
-                rating = float(match.group(1))
-                count = int(match.group(2).replace(",", ""))
-                result['rating'] = rating
-                result['count'] = count
-            
-        else:
-            total_count = 0
-            total_weighted_sum = 0
-            for i, bar in enumerate(soup.find_all("li", class_="rating-histogram-bar")):
-                title = bar.select("a")
-                if title:
-                    parts = title[0].get("title").split(' ')
-                    count = int(re.match(r'^\d+', parts[0]).group()) if re.match(r'^\d+', parts[0]) else None
-                    total_count += count
-                    rating = (i + 1) / 2
-                    total_weighted_sum += count * rating
-            
-            result['rating'] = round(total_weighted_sum / total_count, 2) if total_count > 0 else 0
-            result['count'] = total_count
-        
-        # print(result)
-        return result
+        return await Parser.run(Extract.average_rating, page)
     
-    def extract_metadata(self, soup: BeautifulSoup) -> Tuple[str, List[str], List[str], Optional[str]]:
-
-        try:
-            dir = soup.find("div", id="tab-crew").find_all("a", class_="text-slug")[0].text
-        except:
-            dir = ""
-        try:
-            actors = [i.text for i in soup.find("div", class_="cast-list").find_all("a")[:3]]
-        except:
-            actors = []
-        try:
-            themes = [i.text for i in soup.find("div", id="tab-genres").find_all("div")[1].find_all("a")[:-1]]
-        except:
-            themes = []
-
-        element = soup.find(class_="micro-button track-event", attrs={'data-track-action': 'TMDb'})
-        if element:
-            link = element['href']
-            tmdb_id_match = re.search(r'/movie/(\d+)', link)
-            tmdb_id =  tmdb_id_match.group(1) if tmdb_id_match else None
-
-        return dir, actors, themes, tmdb_id
+    async def extract_metadata(self, html: str) -> Tuple[str, List[str], List[str], Optional[str]]:
+        return await Parser.run(Extract.metadata, html)
 
     async def extract_nanogenres(self, session: aiohttp.ClientSession, name: str) -> List[str]:
-        url = f"https://letterboxd.com/film/{name}/nanogenres/"
+        url = f"{LETTERBOXD_URL}/film/{name}/nanogenres/"
         page = await self.fetch(session, url)
-        soup = BeautifulSoup(page, "lxml")
-        if soup.find_all("h2", class_="title"):
-            nanogenres = list(set([i.strip() for sublist in [i.text.strip().split(",") for i in soup.find_all("h2", class_="title")] for i in sublist]))
-        else:
-            nanogenres = []
-        return nanogenres
+        return await Parser.run(Extract.nanogenres, page)
+
+    @staticmethod
+    def decode_static_row(static_data: Tuple) -> Tuple[Dict[str, Any], List[str], str, List[str], List[str]]:
+        tmdb_data = {
+            'title': static_data[1],
+            'tmdb_id': int(static_data[2]),
+            'release_date': static_data[3],
+            'countries': json.loads(static_data[4]),
+            'spoken_languages': json.loads(static_data[5]),
+            'og_lang': static_data[6],
+            'genres': json.loads(static_data[7]),
+            'runtime': int(static_data[8]),
+        }
+        actors = json.loads(static_data[9])
+        dir = static_data[10]
+        themes = json.loads(static_data[11])
+        nanogenres = json.loads(static_data[12])
+
+        return tmdb_data, actors, dir, themes, nanogenres
+
+    @staticmethod
+    def decode_semistatic_row(data: Tuple) -> Tuple[Dict[str, Any], Dict[str, int], datetime]:
+        stats = {
+            'icon-watched': data[2],
+            'icon-liked': data[3],
+            'icon-top250': data[4]
+        }   
+        ratings = {
+            'rating': data[5],
+            'count': data[6]
+        } 
+        return ratings, stats, datetime.fromisoformat(data[1])
+
+    async def lookup_films(self, names: List[str]) -> Tuple[Dict[str, Tuple], Dict[str, Tuple]]:
+        refresher.record(names)
+        static_data = {}
+        semistatic_data = {}
+        for name in names:
+            cached = self.static_cache.get(name)
+            if cached is not None:
+                static_data[name] = cached
+            cached = self.semistatic_cache.get(name)
+            if cached is not None:
+                semistatic_data[name] = cached
+        in_memory = (set(static_data), set(semistatic_data))
+
+        static_misses = [name for name in names if name not in static_data]
+        semistatic_misses = [name for name in names if name not in semistatic_data]
+        static_rows, semistatic_rows = await asyncio.gather(fetch_static_rows(static_misses), fetch_semistatic_rows(semistatic_misses))
+
+        for name, row in static_rows.items():
+            static_data[name] = self.decode_static_row(row)
+            self.static_cache.put(name, static_data[name])
+        for name, row in semistatic_rows.items():
+            semistatic_data[name] = self.decode_semistatic_row(row)
+            # stale rows are handed to the scraper to refresh, not cached
+            if datetime.now() - semistatic_data[name][2] < self.semistatic_cache.ttl:
+                self.semistatic_cache.put(name, semistatic_data[name], timestamp=semistatic_data[name][2])
 
-    async def fetch_static_data(self, session: aiohttp.ClientSession, name: str) -> Tuple[Optional[Dict[str, Any]], List[str], str, List[str], List[str]]:
-   
-        static_data = fetch_static_row(name)
-        if static_data:
-            # print("fetching data from db")
-            tmdb_data = {
-                'title': static_data[1],
-                'tmdb_id': int(static_data[2]),
-                'release_date': static_data[3],
-                'countries': json.loads(static_data[4]),
-                'spoken_languages': json.loads(static_data[5]),
-                'og_lang': static_data[6],
-                'genres': json.loads(static_data[7]),
-                'runtime': int(static_data[8]),
-            }
-            actors = json.loads(static_data[9])
-            dir = static_data[10]
-            themes = json.loads(static_data[11])
-            nanogenres = json.loads(static_data[12])
+        current_time = datetime.now()
+        for name in names:
+            # memory hits never reach SQLite, they are counted apart from its hits
+            if name in in_memory[0]:
+                Metrics.CACHE_LOOKUPS.inc('staticData', 'memory')
+            else:
+                Metrics.CACHE_LOOKUPS.inc('staticData', 'hit' if name in static_data else 'miss')
+            if name in in_memory[1]:
+                Metrics.CACHE_LOOKUPS.inc('semi_static_data', 'memory')
+            elif name not in semistatic_data:
+                Metrics.CACHE_LOOKUPS.inc('semi_static_data', 'miss')
+            else:
+                Metrics.CACHE_LOOKUPS.inc('semi_static_data', 'stale' if (current_time - semistatic_data[name][2]).days >= 5 else 'hit')
 
-            return tmdb_data, actors, dir, themes, nanogenres 
+        return static_data, semistatic_data
 
-        else:
-            # print("using api")
-            url = f"https://letterboxd.com/film/{name}"
+    async def fetch_static_data(self, session: aiohttp.ClientSession, name: str, static_data: Optional[Tuple] = None) -> Tuple[Optional[Dict[str, Any]], List[str], str, List[str], List[str]]:
+   
+        async def new_data():
+            # another user's flight may have scraped it since lookup_films ran for this page
+            cached = self.static_cache.get(name)
+            if cached is not None:
+                return cached
+
+            url = f"{LETTERBOXD_URL}/film/{name}"
             html = await self.fetch(session, url)  
-            soup = BeautifulSoup(html, 'lxml') 
 
             nanogenres = await self.extract_nanogenres(session, name)
-            dir, actors, themes, tmdb_id = self.extract_metadata(soup)
+            dir, actors, themes, tmdb_id = await self.extract_metadata(html)
             tmdb_data = await self.fetch_tmdb_details(tmdb_id, session) if tmdb_id else None
             if tmdb_data:
-                insert_into_static((name, tmdb_data, actors, dir, themes, nanogenres))
-                pass
+                insert_static_rows([(name, tmdb_data, actors, dir, themes, nanogenres)])
+                self.static_cache.put(name, (tmdb_data, actors, dir, themes, nanogenres))
             return tmdb_data, actors, dir, themes, nanogenres 
 
-    async def fetch_semistatic_data(self, session: aiohttp.ClientSession, name: str):
+        if static_data:
+            return static_data
+
+        else: # concurrent requests for the same film share one scrape
+            return await self.film_flights.do(('static', name), new_data)
+
+    async def refresh_semistatic_data(self, session: aiohttp.ClientSession, name: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        ratings = await self.extract_average_rating(session, name)
+        stats = await self.extract_stats(session, name)
+        # rows missing the rating are served but not cached
+        if 'rating' in ratings and 'count' in ratings:
+            current_time = datetime.now()
+            upsert_semistatic_rows([(name, ratings, stats, current_time.isoformat())])
+            self.semistatic_cache.put(name, (ratings, stats, current_time), timestamp=current_time)
+        return ratings, stats
+
+    async def fetch_semistatic_data(self, session: aiohttp.ClientSession, name: str, data: Optional[Tuple] = None):
 
         async def new_data():
-            ratings = await self.extract_average_rating(session, name)
-            stats = await self.extract_stats(session, name)
-            return ratings, stats
+            # another user's flight may have refreshed it since lookup_films ran for this page;
+            # the LRU only holds rows younger than its TTL
+            cached = self.semistatic_cache.get(name)
+            if cached is not None:
+                return cached[0], cached[1]
+            return await self.refresh_semistatic_data(session, name)
         
-        result = does_data_exists(name) #check if the data exists in the db
         current_time = datetime.now()
 
-        if result: #if it does
-            # print("results exist")
-            timestamp = datetime.fromisoformat(result[0])
+        if data: #if it exists in the db
+            ratings, stats, timestamp = data
             is_stale = (current_time - timestamp).days >= 5
-            if is_stale: # if data is older than 2 days, update it
-               ratings, stats = await new_data()
-               update_semistatic((name, ratings, stats, current_time.isoformat()))
-               return ratings, stats
-            #    print("data updated")
-            else: # if data is fresh, fetch it from db
-                data = fetch_semistatic_row(name)
-                stats = {
-                    'icon-watched': data[2],
-                    'icon-liked': data[3],
-                    'icon-top250': data[4]
-                }   
-                ratings = {
-                    'rating': data[5],
-                    'count': data[6]
-                } 
-                # print("semi static data fetched")
+            if is_stale: # if data is older than 5 days, serve it and refresh it in the background
+                if refresher.submit(('semistatic', name), lambda: self.film_flights.do(('semistatic', name), new_data)):
+                    return ratings, stats
+                return await self.film_flights.do(('semistatic', name), new_data)
+            else: # if data is fresh, use it as is
                 return ratings, stats
             
-        else: # if data doesnt exist, insert it
-            ratings, stats = await new_data()
-            insert_into_semistatic((name, ratings, stats, current_time.isoformat()))
-            return ratings, stats
-            
-    async def compile_data(self, session: aiohttp.ClientSession, link: str, review: str, like: bool, user_rating: float) -> Dict[str, Any]:
+        else: # if data doesnt exist, scrape it
+            return await self.film_flights.do(('semistatic', name), new_data)
+
+    @classmethod
+    async def sweep(cls, session: aiohttp.ClientSession) -> None:
+        # refresh popular films before a request finds them stale
+        names = refresher.most_requested(SWEEP_SIZE)
+        rows = await fetch_semistatic_rows(names)
+        scraper = cls(None, session)
+        current_time = datetime.now()
+        for name, row in rows.items():
+            _, _, timestamp = cls.decode_semistatic_row(row)
+            if current_time - timestamp >= timedelta(days=5) - SWEEP_AHEAD:
+                refresh = lambda name=name: cls.film_flights.do(('semistatic', name), lambda: scraper.refresh_semistatic_data(session, name))
+                refresher.submit(('semistatic', name), refresh, priority=SWEEP)
+
+    async def compile_data(self, session: aiohttp.ClientSession, link: str, review: str, like: bool, user_rating: float,
+                           static_data: Optional[Tuple] = None, semistatic_data: Optional[Tuple] = None,
+                           activity: Optional[Tuple[str, bool]] = None) -> Dict[str, Any]:
         name = link.split('/')[-2]
 
-        static_data_task = self.fetch_static_data(session, name)
-        semi_static_data_task = self.fetch_semistatic_data(session, name)
+        static_data_task = self.fetch_static_data(session, name, static_data)
+        semi_static_data_task = self.fetch_semistatic_data(session, name, semistatic_data)
 
         static_data, semi_static_data = await asyncio.gather(static_data_task, semi_static_data_task)
         # Extract data from the results
         tmdb_data, actors, dir, themes, nanogenres = static_data
         ratings, stats = semi_static_data
-        #user-specific data
-        last_watched_date, is_rewatched = await self.extract_watch_activity(session, name)
+        if not isinstance(tmdb_data, dict):
+            self.failed_films += 1
+        #user-specific data, scraped unless the caller already has it (e.g. from an export)
+        if activity is None:
+            activity = await self.watch_activity(session, name)
+        last_watched_date, is_rewatched = activity
 
         return {
             #static data
@@ -366,71 +398,175 @@ class MovieDataScraper:
             'user_rating': user_rating,
             'is_liked': like,
             'is_reviewed': review,
+            'slug': name,
         }
 
-    async def start_process(self, session: aiohttp.ClientSession, url: str, batch_size=24) -> List[Dict[str, Any]]:
-        html = await self.fetch(session, url)
-        if not html:
-            return []  # Return empty list if fetching failed
+    async def compile_page(self, session: aiohttp.ClientSession, movie_links: List[str], reviews: List[bool], likes: List[bool],
+                           user_ratings: List[float], batch_size=24,
+                           activities: Optional[List[Tuple[str, bool]]] = None) -> List[Dict[str, Any]]:
+        # resolve the whole page against the cache up front, only misses go to the network
+        names = [link.split('/')[-2] for link in movie_links]
+        static_data, semistatic_data = await self.lookup_films(names)
+        activities = activities or [None] * len(names)
         
-        movie_links, reviews, likes, user_ratings = await self.extract_movie_links(html)
-        
-        tasks = [self.compile_data(session, link, review, like, user_rating)
-                for link, review, like, user_rating in zip(movie_links, reviews, likes, user_ratings)]
+        tasks = [self.compile_data(session, link, review, like, user_rating, static_data.get(name), semistatic_data.get(name), activity)
+                for link, review, like, user_rating, name, activity in zip(movie_links, reviews, likes, user_ratings, names, activities)]
         
         batched_data = []
         for i in range(0, len(tasks), batch_size):
             batch = tasks[i:i + batch_size]
             batch_result = await asyncio.gather(*batch, return_exceptions=True)
             batch_result = [data for data in batch_result if data is not None and not isinstance(data, Exception)]
+            self.failed_films += len(batch) - len(batch_result)
             batched_data.extend(batch_result)
-        
+
         return batched_data
 
-    def page_nums(self) -> int:
-        url = f"https://letterboxd.com/{self.user}/films"
-        html = requests.get(url)
-        soup = BeautifulSoup(html.text, "lxml")
-        try:
-            num_pages = int(soup.find_all("li", class_="paginate-page")[-1].get_text())
-        except:
-            num_pages = 1
-        return num_pages
-    
-    async def scrape(self, batch_size: int = 2) -> List['MovieData']:
-        pages = self.page_nums()
-        urls = [f"https://letterboxd.com/{self.user}/films/page/{i}/" for i in range(1, pages + 1)]
+    async def process_page(self, session: aiohttp.ClientSession, html: str) -> List[Dict[str, Any]]:
+        movie_links, reviews, likes, user_ratings = await self.extract_movie_links(html)
+        return await self.compile_page(session, movie_links, reviews, likes, user_ratings)
+
+    async def start_process(self, session: aiohttp.ClientSession, url: str) -> List[Dict[str, Any]]:
+        html = await self.fetch(session, url)
+        if not html:
+            self.failed_pages += 1
+            return []  # Return empty list if fetching failed
+        return await self.process_page(session, html)
+
+    async def page_nums(self, html: str) -> int:
+        return await Parser.run(Extract.page_count, html)
+
+    def validate(self, page_results: List[Dict[str, Any]]) -> List['MovieData']:
+        page_data = []
+        for movie_data in page_results:
+            try:
+                page_data.append(MovieData(**movie_data))
+            except Exception:
+                self.failed_films += 1
+        return page_data
+
+    def save_snapshot(self, films: List['MovieData'], scanned: Optional[str] = None) -> None:
+        # scanned: when the full scan these films build on was made, now for a full scan
+        upsert_snapshot((self.user, scanned or datetime.now().isoformat(), [film.model_dump() for film in films]))
+
+    async def full_pages(self, first_page: str, batch_size: int) -> AsyncIterator[List['MovieData']]:
+        session = self.session
         all_movie_data = []
 
-        async with aiohttp.TCPConnector(limit_per_host=3) as connector:
-            async with aiohttp.ClientSession(connector=connector) as session:
+        pages = await self.page_nums(first_page)
+        urls = [f"{LETTERBOXD_URL}/{self.user}/films/page/{i}/" for i in range(2, pages + 1)]
+        # every page but the last is full, so page 1 gives the count up to one page
+        first_links = await self.extract_movie_links(first_page)
+        if self.use_diary((pages - 1) * FILMS_PER_PAGE + len(first_links[0])):
+            self.diary = asyncio.create_task(self.extract_diary(session))
+
+        jobs = [lambda: self.compile_page(session, *first_links)]
+        jobs += [lambda url=url: self.start_process(session, url) for url in urls]
 
-                for i in range(0, len(urls), batch_size):
-                    batch = urls[i:i + batch_size]
-                    
+        for i in range(0, len(jobs), batch_size):
+            tasks = [asyncio.create_task(job()) for job in jobs[i:i + batch_size]]
+            
+            try:
+                # pages are yielded in order, each as soon as it is done
+                for task in tasks:
                     try:
-                        batch_results = await asyncio.gather(
-                            *(self.start_process(session, url) for url in batch),
-                            return_exceptions=True
-                        )
-                        
-                        def result_generator():
-                            for sublist in batch_results:
-                                if isinstance(sublist, list):
-                                    yield from sublist
-
-                        for movie_data in result_generator():
-                            try:
-                                valid_data = MovieData(**movie_data)
-                                all_movie_data.append(valid_data)
-                                
-                            except Exception:
-                                continue
-
-                        if len(all_movie_data) < 20 and i == 0:
-                            raise UserMovieCountError(f"User has not watched enough movies")
-
-                    except Exception as e:
-                        print(f"Batch processing error: {e}")
-
-        return all_movie_data
\ No newline at end of file
+                        page_results = await task
+                    except Exception:
+                        self.failed_pages += 1
+                        continue
+
+                    page_data = self.validate(page_results)
+                    all_movie_data.extend(page_data)
+                    yield page_data
+
+                if len(all_movie_data) < 20 and i == 0:
+                    raise UserMovieCountError(f"User has not watched enough movies")
+
+            except Exception as e:
+                print(f"Batch processing error: {e}")
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        if not self.failed_pages and not self.failed_films:
+            self.save_snapshot(all_movie_data)
+
+    async def refresh_pages(self, first_page: str, snapshot: List[Dict[str, Any]], scanned: str) -> AsyncIterator[List['MovieData']]:
+        # films are listed newest first, so only the ones above the first known slug are new
+        session = self.session
+        known = {film['slug'] for film in snapshot}
+        pages = await self.page_nums(first_page)
+        new_movie_data = []
+        new_count = 0
+
+        html = first_page
+        for page in range(1, pages + 1):
+            if page > 1:
+                html = await self.fetch(session, f"{LETTERBOXD_URL}/{self.user}/films/page/{page}/")
+                if not html:
+                    self.failed_pages += 1
+                    break
+
+            movie_links, reviews, likes, user_ratings = await self.extract_movie_links(html)
+            names = [link.split('/')[-2] for link in movie_links]
+            cut = next((i for i, name in enumerate(names) if name in known), len(names))
+            new_count += cut
+            if new_count > 0 and self.diary is None and self.use_diary(new_count):
+                self.diary = asyncio.create_task(self.extract_diary(session))
+
+            page_results = await self.compile_page(session, movie_links[:cut], reviews[:cut], likes[:cut], user_ratings[:cut])
+            page_data = self.validate(page_results)
+            new_movie_data.extend(page_data)
+            if page_data:
+                yield page_data
+            if cut < len(names):
+                break
+
+        new_slugs = {film.slug for film in new_movie_data}
+        old_movie_data = self.validate([film for film in snapshot if film['slug'] not in new_slugs])
+        yield old_movie_data
+
+        if not self.failed_pages and not self.failed_films:
+            self.save_snapshot(new_movie_data + old_movie_data, scanned)
+
+    async def scrape_pages(self, batch_size: int = 2) -> AsyncIterator[List['MovieData']]:
+        self.failed_pages = 0
+        self.failed_films = 0
+
+        # page 1 gives both the page count and the first films, so it is only fetched once
+        first_page = await self.fetch(self.session, f"{LETTERBOXD_URL}/{self.user}/films/")
+        if not first_page:
+            return
+
+        snapshot = await fetch_snapshot(self.user)
+        if snapshot and (datetime.now() - datetime.fromisoformat(snapshot[0])).days < SNAPSHOT_MAX_AGE:
+            pages = self.refresh_pages(first_page, json.loads(snapshot[1]), snapshot[0])
+        else:
+            pages = self.full_pages(first_page, batch_size)
+
+        try:
+            async for page_data in pages:
+                yield page_data
+        finally:
+            if self.diary is not None:
+                self.diary.cancel()
+                self.diary = None
+
+    async def scrape(self, batch_size: int = 2) -> List['MovieData']:
+        all_movie_data = []
+        async for page_data in self.scrape_pages(batch_size):
+            all_movie_data.extend(page_data)
+        return all_movie_data
+
+# the in-memory LRU layer in front of staticData and semi_static_data, read at /metrics time
+def memory_caches() -> Dict[str, LRUCache]:
+    return {'staticData': MovieDataScraper.static_cache, 'semi_static_data': MovieDataScraper.semistatic_cache}
+
+Metrics.Collected(
+    'unboxd_memory_cache_entries', "Entries held by the in-memory film caches",
+    ['cache'], 'gauge', lambda: {(name,): cache.stats()['size'] for name, cache in memory_caches().items()})
+Metrics.Collected(
+    'unboxd_memory_cache_events_total', "In-memory film cache hits, misses, expired entries and evictions",
+    ['cache', 'event'], 'counter',
+    lambda: {(name, event): count for name, cache in memory_caches().items()
+             for event, count in cache.stats().items() if event != 'size'})
@@ -0,0 +1,46 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from dotenv import load_dotenv
+from components import Metrics
+
+load_dotenv()
+
+# Where the Extract functions run, picked per deployment with PARSE_MODE:
+#   inline  - on the event loop; cheapest, but other requests wait while a page is parsed
+#   thread  - on a thread pool; keeps the loop free as long as lxml isn't holding the GIL
+#   process - on a process pool; only the raw HTML goes out and the extracted
+#             lists/dicts come back, so the loop never does any parsing
+PARSE_MODES = ('inline', 'thread', 'process')
+PARSE_MODE = os.getenv('PARSE_MODE', 'process')
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', min(4, os.cpu_count() or 1)))
+
+executor: Optional[Executor] = None
+
+def start_pool(mode: str = PARSE_MODE, workers: int = PARSE_WORKERS) -> None:
+    global executor
+    if mode not in PARSE_MODES:
+        raise ValueError(f"PARSE_MODE must be one of {', '.join(PARSE_MODES)}, got {mode!r}")
+
+    stop_pool()
+    if mode == 'process':
+        # spawn, not fork: the database writer thread is already running in this process
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    elif mode == 'thread':
+        executor = ThreadPoolExecutor(workers, thread_name_prefix='parser')
+
+def stop_pool() -> None:
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+        executor = None
+
+# fn must be a module-level function (the Extract functions are) so it can be
+# sent to a worker process. Without a pool (scripts, tests) it runs inline.
+async def run(fn: Callable[..., Any], *args: Any) -> Any:
+    with Metrics.stage('parse'):  # includes the wait for a free worker
+        if executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
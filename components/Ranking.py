@@ -1,25 +1,56 @@
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-import re
-import json
-import requests
+import os
 # from tqdm.asyncio import tqdm
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from dotenv import load_dotenv
+from scipy import sparse
 from sklearn.metrics.pairwise import cosine_similarity
-from database.database import (create_friends_table, does_user_exist, fetch_user_data, insert_user_data, update_user_data)
+from database.database import fetch_user_data, upsert_user_data, fetch_group_ratings, fetch_films, flush_users
+from components.Session import governor, LETTERBOXD_URL, TMDB_URL
+from components import Extract, Metrics, Parser
+from components.Refresher import refresher
+from components.DataProcessor import descending
+
+load_dotenv()
+
+# recommendations only count films logged by at least RECOMMEND_MIN_RATERS similar
+# friends, and with RECOMMEND_SHRINKAGE > 0 a film's score is scaled by
+# raters / (raters + shrinkage), so one enthusiastic friend can't top the list
+RECOMMEND_MIN_RATERS = int(os.getenv('RECOMMEND_MIN_RATERS', 1))
+RECOMMEND_SHRINKAGE = float(os.getenv('RECOMMEND_SHRINKAGE', 0))
+
+def rating_matrix(names, users, films, ratings):
+    # user x film CSR matrix from fetch_group_ratings' arrays: mean rating + 1 for
+    # every film a user has logged (so an unrated film still counts), nothing stored
+    # for the rest. Rows are the sorted display names (users in names), friends with
+    # the same one merged; columns are film ids, ascending.
+    name_codes, name_index = pd.factorize(pd.Series(names, dtype=object), sort=True)
+    rows = name_codes[users]
+    keep = (rows >= 0) & ~np.isnan(ratings)
+    user_codes, user_rows = pd.factorize(rows[keep], sort=True)
+    film_codes, film_ids = pd.factorize(films[keep], sort=True)
+
+    shape = (len(user_rows), len(film_ids))
+    sums = sparse.csr_matrix((ratings[keep], (user_codes, film_codes)), shape=shape)
+    if sums.nnz < len(user_codes):
+        # two friends under one display name logged the same film; same coordinates, same structure
+        counts = sparse.csr_matrix((np.ones(len(user_codes)), (user_codes, film_codes)), shape=shape)
+        sums.data = sums.data / counts.data
+    sums.data += 1
+    return sums, name_index.take(user_rows), film_ids
 
 class Ranking:
 
-    def __init__(self, user, subset):
+    def __init__(self, user, subset, session: aiohttp.ClientSession):
         self.user = user
+        self.session = session
         self.subset = subset
         self.name_map = {}
         self.rev_name_map = {}
         self.pic_map = {}
-        self.link_title_map = {}
-        create_friends_table()
         
     async def fetch(self, session: aiohttp.ClientSession, url: str):
         max_attempts = 3
@@ -28,12 +59,16 @@ class Ranking:
 
         for attempt in range(max_attempts):
             try:
-                async with session.get(url) as response:
-                    # print(f"Fetching {url} (Attempt {attempt + 1}/{max_attempts})")
-                    if 'api.themoviedb.org' in url:
-                        return await response.json()
-                    else:
-                        return await response.text()
+                async with governor.request(url) as slot:
+                    async with session.get(url) as response:
+                        # print(f"Fetching {url} (Attempt {attempt + 1}/{max_attempts})")
+                        slot.observe(response)
+                        if response.status == 429:
+                            response.raise_for_status()  # retried once the governor lets the host through
+                        if url.startswith(TMDB_URL):
+                            return await response.json()
+                        else:
+                            return await response.text()
             except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 if isinstance(e, aiohttp.ClientError):
                     print(f"Client error while fetching {url}: {e}")
@@ -43,6 +78,7 @@ class Ranking:
                 if attempt < max_attempts - 1:
                     wait_time = min(base_wait_time * (2 ** attempt), max_wait_time)
                     print(f"Retrying in {wait_time} seconds...")
+                    Metrics.FETCH_RETRIES.inc(Metrics.url_pattern(url))
                     await asyncio.sleep(wait_time)
                 else:
                     print(f"Max attempts reached. Fetch failed for {url}")
@@ -50,17 +86,13 @@ class Ranking:
                 print(f"An error occurred while fetching {url}: {e}")
                 break  
 
+        Metrics.FETCH_FAILURES.inc(Metrics.url_pattern(url))
         return None
 
-    def profile_info(self):
-        profile = f"https://letterboxd.com/{self.user}/"
-        page = requests.get(profile)
-        soup = BeautifulSoup(page.text, 'lxml')
-
-        h = soup.find('div', class_="profile-stats js-profile-stats").select('h4')
-        follower_count = int(h[-1].find('a').find('span', class_='value').text) if "followers" in h[-1].find('a')['href'] else 0
-        following_count = int(h[-2].find('a').find('span', class_='value').text) if "following" in h[-2].find('a')['href'] else 0
-        dp = soup.find('h1', class_='person-display-name').text
+    async def profile_info(self):
+        profile = f"{LETTERBOXD_URL}/{self.user}/"
+        page = await self.fetch(self.session, profile)
+        follower_count, following_count, dp = await Parser.run(Extract.profile_stats, page or '')
         follower_pages = (follower_count // 25) + 1
         following_pages = (following_count // 25) + 1
 
@@ -68,34 +100,17 @@ class Ranking:
 
     async def fetch_friend_list(self, session, url):
         
-        names = []
-        urls = []
-        pics = []
-        
         response = await self.fetch(session, url)
         if response is None:
-            return names, urls
-        soup = BeautifulSoup(response, "lxml")
-
-        for person in soup.find_all('td', class_='table-person'):
-            name = person.find('img')['alt']
-            pic = person.find('img')['src'] if person.find('img')['src'] else None
-            url = person.find('a', class_='avatar')['href']
-            names.append(name)
-            urls.append(url)
-            pics.append(pic)
-            assert len(names) == len(urls)
-        
-        return names, urls, pics
+            return [], [], []
+        return await Parser.run(Extract.friend_list, response)
 
     async def extract_friends(self, type, page_num):
 
-        urls =  [f"https://letterboxd.com/{self.user}/{type}/page/{i}/" for i in range(1, page_num + 1)]
+        urls =  [f"{LETTERBOXD_URL}/{self.user}/{type}/page/{i}/" for i in range(1, page_num + 1)]
 
-        connector = aiohttp.TCPConnector(limit_per_host=5) 
-        async with aiohttp.ClientSession(connector=connector) as session:
-            tasks = [self.fetch_friend_list(session, url) for url in urls]
-            results = await asyncio.gather(*tasks)
+        tasks = [self.fetch_friend_list(self.session, url) for url in urls]
+        results = await asyncio.gather(*tasks)
         
         names, urls, pics = [], [], []
         for result in results:
@@ -109,59 +124,31 @@ class Ranking:
         html = await self.fetch(session, url)
         if not html:
             return [], [], []
-        
-        links = []
-        user_ratings = []
-        titles = []
-
-        soup = BeautifulSoup(html, 'lxml')
-
-        for li in soup.find_all('li', class_="poster-container"):
-            poster_div = li.find('div', class_="poster")
-            if poster_div:
-                link = poster_div.get('data-target-link')
-                links.append(link) if link else links.append(None)
-
-                title = poster_div.find('img')['alt']
-                titles.append(title) if title else titles.append(None)
-                
-            rating = li.find('span', class_='rating')
-            if rating:
-                match = re.search(r"rated-(\d+)", rating['class'][-1])
-                number = int(match.group(1)) / 2
-                user_ratings.append(number)
-            else:
-                user_ratings.append(0)
+        return await self.parse_movie_data(html)
 
+    async def parse_movie_data(self, html):
+        links, titles, user_ratings = await Parser.run(Extract.movie_titles, html)
         assert len(titles) == len(links)
         return links, titles, user_ratings
    
-    async def page_nums(self, session, user):
-        url = f"https://letterboxd.com/{user}/films"
-        html = await self.fetch(session, url)
-        if html is None:
-            return 1
-        soup = BeautifulSoup(html, "lxml")
-        try:
-            num_pages = int(soup.find_all("li", class_="paginate-page")[-1].get_text())
-        except:
-            num_pages = 1
-        return num_pages
+    async def page_nums(self, html):
+        return await Parser.run(Extract.page_count, html)
     
     async def fetch_batch(self, session, urls):
-        connector = aiohttp.TCPConnector(limit_per_host=5)  # Limit parallel connections
-        async with aiohttp.ClientSession(connector=connector) as session:
-            tasks = [self.extract_movie_data(session, url) for url in urls]
-            return await asyncio.gather(*tasks)
+        tasks = [self.extract_movie_data(session, url) for url in urls]
+        return await asyncio.gather(*tasks)
         
     async def extract_movies_for_user(self, session, user, batch_size=10):
 
 
         async def get_data():        
-            pages = await self.page_nums(session, user)
-            urls = [f"https://letterboxd.com/{user}/films/page/{i}/" for i in range(1, pages + 1)]
+            first_page = await self.fetch(session, f"{LETTERBOXD_URL}/{user}/films/")
+            if first_page is None:
+                return [], [], []
+            pages = await self.page_nums(first_page)
+            urls = [f"{LETTERBOXD_URL}/{user}/films/page/{i}/" for i in range(2, pages + 1)]
         
-            results = []
+            results = [await self.parse_movie_data(first_page)]
             for i in range(0, len(urls), batch_size):
                 batch = urls[i:i + batch_size]
                 results.extend(await self.fetch_batch(session, batch))
@@ -175,39 +162,40 @@ class Ranking:
                 titles.extend(title)
                 
             return titles, ratings, links
+
+        async def refresh():
+            titles, ratings, links = await get_data()
+            upsert_user_data((user, datetime.now().isoformat(), titles, links, ratings))
+            return len(titles)
         
-        result = does_user_exist(user)
+        # only the film count is read here; the ratings themselves are loaded for
+        # the whole group at once by start_extraction
+        data = await fetch_user_data(user)
         current_time = datetime.now()
-        if result:
-            timestamp = datetime.fromisoformat(result[0])
+        if data:
+            timestamp = datetime.fromisoformat(data[0])
             is_stale = (current_time - timestamp).days >= 5
-            if is_stale:
-                titles, ratings, links = await get_data()
-                update_user_data((user, current_time.isoformat(), titles, links, ratings))
-            else:
-
-                data = fetch_user_data(user)
-                titles, links, ratings = json.loads(data[0]), json.loads(data[1]), json.loads(data[2])
+            Metrics.CACHE_LOOKUPS.inc('user_data', 'stale' if is_stale else 'hit')
+            if is_stale and not refresher.submit(('user_data', user), refresh):
+                film_count = await refresh()
+            else: # fresh, or stale and being refreshed in the background
+                film_count = data[1]
         
         else:
-            titles, ratings, links = await get_data()
-            insert_user_data((user, current_time.isoformat(), titles, links, ratings))
+            Metrics.CACHE_LOOKUPS.inc('user_data', 'miss')
+            film_count = await refresh()
   
 
 
         if user == self.user:
-            if len(titles) < 20:
+            if film_count < 20:
 
                 raise ValueError(f"The user {user} has less than 5 movies in their Letterboxd profile.")
             
-        return {
-            'titles': titles,
-            'ratings': ratings,
-            'links' : links
-        }
+        return film_count
     
     async def start_extraction(self, batch_size = 10):
-        follower_pages, following_pages, dp = self.profile_info()
+        follower_pages, following_pages, dp = await self.profile_info()
         if self.subset == "followers":
             user_names, names, pics = await self.extract_friends("followers", follower_pages)
         elif self.subset == "following":
@@ -253,11 +241,9 @@ class Ranking:
         urls =  user_names + [self.user] 
 
         async def user_batch_fetch(urls):
-            connector = aiohttp.TCPConnector(limit_per_host=5)  
-            async with aiohttp.ClientSession(connector=connector) as session:
-                tasks = [self.extract_movies_for_user(session, user) for user in urls] 
-                return await asyncio.gather(*tasks)
-                # return await tqdm.gather(*tasks, desc="Scraping User List", total=len(urls))
+            tasks = [self.extract_movies_for_user(self.session, user) for user in urls] 
+            return await asyncio.gather(*tasks)
+            # return await tqdm.gather(*tasks, desc="Scraping User List", total=len(urls))
 
         results = []
         for i in range(0, len(urls), batch_size):
@@ -265,75 +251,93 @@ class Ranking:
             try:
                 results.extend(await user_batch_fetch(batch))
             except ValueError as e:
+                # a user with too few films; main turns this into Rank_400
                 print(f"Error: {e}")
-                return None
+                raise
             
-        data = {'user': [], 'title': [], 'rating': [], 'links' : []}
+        # what was just scraped has to be committed before the group is read back
+        await asyncio.to_thread(flush_users)
+        users, films, ratings = await fetch_group_ratings(urls)
 
-        for user, result in zip(user_names + [self.user], results):
-            titles = result['titles']
-            ratings = result['ratings']
-            links = result['links']
-
-            data['user'].extend([name_map[user]] * len(links))
-            data['title'].extend(titles)
-            data['rating'].extend(ratings)
-            data['links'].extend(links)
-
-
-        link_title_map = {link: title for title, link in zip(data['title'], data['links'])}
-        self.link_title_map = link_title_map
-
-        return data
-
-    def recommend_movies(self, pivot_table, user_similarity_df, n_recommendations=10):
-        user = self.name_map[self.user]
-
-        user_ratings = pivot_table.loc[user]
-        sum_of_sim = user_similarity_df.drop(columns=[user]).loc[user].sum()
-        similar_users = user_similarity_df[user].sort_values(ascending=False)
-        recommendations = pd.Series()
+        return {
+            'users': urls,
+            'user': users,
+            'film': films,
+            'rating': ratings,
+        }
 
-        for similar_user, similarity_score in similar_users.items():
-            if similar_user != user:
-                similar_user_ratings = pivot_table.loc[similar_user]
-                unrated_movies = similar_user_ratings[user_ratings == 0]
-                recommendations = recommendations.add(unrated_movies * similarity_score, fill_value=0)
+    def recommend_movies(self, ratings, users, films, similarity, n_recommendations=10,
+                         min_raters=RECOMMEND_MIN_RATERS, shrinkage=RECOMMEND_SHRINKAGE):
+        me = users.get_loc(self.name_map[self.user])
+
+        # every friend's ratings weighted by their similarity, summed per film in one
+        # product, over the sum of similarities: a similarity-weighted average in
+        # which films a friend hasn't logged count as 0
+        weights = similarity.copy()
+        weights[me] = 0
+        sum_of_sim = weights.sum()
+        unrated = np.ones(ratings.shape[1], dtype=bool)
+        unrated[ratings[me].indices] = False
+        columns = np.flatnonzero(unrated)
+        recommendations = (ratings.T @ weights)[columns] / sum_of_sim
+
+        if min_raters > 1 or shrinkage > 0:
+            logged = ratings.astype(bool).astype(np.int32)
+            raters = (logged.T @ (weights > 0).astype(np.int32))[columns]
+            if shrinkage > 0:
+                recommendations = recommendations * (raters / (raters + shrinkage))
+            if min_raters > 1:
+                columns, recommendations = columns[raters >= min_raters], recommendations[raters >= min_raters]
+
+        # the best n without sorting every film; ties go to the lowest film id
+        n = min(n_recommendations, len(columns))
+        if n == 0:
+            return {}
+        if n < len(columns):
+            kth = np.partition(recommendations, len(columns) - n)[len(columns) - n]
+            top = np.flatnonzero(recommendations >= kth)
+        else:
+            top = np.arange(len(columns))
+        top = top[np.lexsort((top, -recommendations[top]))][:n]
+        return dict(zip(films[columns[top]].tolist(), recommendations[top].tolist()))
 
-        recommendations = recommendations / sum_of_sim
-        recommendations = recommendations.sort_values(ascending=False)
-        return recommendations.head(n_recommendations).to_dict()
-    
     async def rank_friends(self):
 
         data = await self.start_extraction()
+        result = self.rank(data)
+
+        films = await fetch_films(list(result['reccomendations']))
+        result['reccomendations'] = {films[film][1] : {
+                'url' : films[film][0],
+                'rating' : value
+            } for film, value in result['reccomendations'].items()}
+        return result
+
+    def rank(self, data):
+        # rankings, and recommendations as film id -> score
         user = self.name_map[self.user]
 
-        df = pd.DataFrame(data)
-        rating_pivot = df.pivot_table(index='user', columns='links', values='rating', aggfunc='mean')
-        updated_ratings = rating_pivot.fillna(0) + 1
-        updated_ratings[rating_pivot.isna()] = None
-        rating_pivot = updated_ratings.fillna(0)
-
-        index_to_keep = rating_pivot.loc[user][rating_pivot.loc[user] != 0].index
-        filtered_pivot = rating_pivot.loc[:, index_to_keep]
-        user_similarity = cosine_similarity(filtered_pivot)
-        user_similarity_df = pd.DataFrame(user_similarity, index=rating_pivot.index, columns=rating_pivot.index)
-
-        rankings = user_similarity_df.drop(columns=[user]).loc[user].sort_values(ascending=False).to_dict()
-        rankings = { key : {
-                'url' : (self.rev_name_map[key] if key in self.rev_name_map else key),
-                'similarity' : value,
-                'pic' : self.pic_map[key] if key in self.pic_map else ''
-            } for key, value in rankings.items()}
+        with Metrics.stage('rank'):
+            names = [self.name_map[name] for name in data['users']]
+            ratings, users, films = rating_matrix(names, data['user'], data['film'], data['rating'])
+            me = users.get_loc(user)
+
+            # similarity to the user over the films they have logged, never densified
+            logged = ratings[:, ratings[me].indices]
+            similarity = cosine_similarity(logged, logged[me]).ravel()
+
+            others = np.delete(np.arange(len(users)), me)
+            order = others[descending(similarity[others])]
+            rankings = dict(zip(users.take(order), similarity[order].tolist()))
+            rankings = { key : {
+                    'url' : (self.rev_name_map[key] if key in self.rev_name_map else key),
+                    'similarity' : value,
+                    'pic' : self.pic_map[key] if key in self.pic_map else ''
+                } for key, value in rankings.items()}
         
-        reccomendations = self.recommend_movies(rating_pivot, user_similarity_df)
-        reccomendations = {self.link_title_map[key] : {
-                'url' : key,
-                'rating' : value
-            } for key, value in reccomendations.items()}
+            reccomendations = self.recommend_movies(ratings, users, films, similarity)
         
-        return {
-            'rankings': rankings,
-            'reccomendations' : reccomendations
-        }
+            return {
+                'rankings': rankings,
+                'reccomendations' : reccomendations
+            }
@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+import os
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set
+from dotenv import load_dotenv
+from components import Metrics
+
+load_dotenv()
+
+# lower runs first: refreshes of rows a user was just served go ahead of the sweeper's
+STALE = 0
+SWEEP = 1
+
+REFRESH_WORKERS = int(os.getenv('REFRESH_WORKERS', 2))
+
+# Stale-while-revalidate: a request that finds stale data serves it as is and
+# queues the refresh here. A couple of workers drain the queue in the background,
+# sharing the session and governor with requests but never holding one up.
+class Refresher:
+
+    def __init__(self, workers: int = REFRESH_WORKERS):
+        self.workers = workers
+        self.queue: Optional[asyncio.PriorityQueue] = None
+        self.pending: Set[Hashable] = set()
+        self.tasks: List[asyncio.Task] = []
+        self.counter = itertools.count()  # keeps equal priorities first in, first out
+        self.requests = Counter()
+        self.done = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self.tasks)
+
+    def start(self) -> None:
+        self.queue = asyncio.PriorityQueue()
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def schedule(self, interval: float, fn: Callable[[], Awaitable[Any]]) -> None:
+        self.tasks.append(asyncio.create_task(self._every(interval, fn)))
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+        self.pending.clear()
+
+    # returns False when there's no worker to run it, so the caller refreshes inline
+    def submit(self, key: Hashable, fn: Callable[[], Awaitable[Any]], priority: int = STALE) -> bool:
+        if not self.running:
+            return False
+        if key not in self.pending:
+            self.pending.add(key)
+            self.queue.put_nowait((priority, next(self.counter), key, fn))
+        return True
+
+    def record(self, keys: Iterable[Hashable]) -> None:
+        self.requests.update(keys)
+
+    def most_requested(self, n: int) -> List[Hashable]:
+        keys = [key for key, _ in self.requests.most_common(n)]
+        # keep the counts bounded: start over from the current top
+        if len(self.requests) > n * 10:
+            self.requests = Counter(dict(self.requests.most_common(n)))
+        return keys
+
+    async def _work(self) -> None:
+        while True:
+            _, _, key, fn = await self.queue.get()
+            try:
+                await fn()
+                self.done += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Background refresh of {key} failed: {e}")
+            finally:
+                self.pending.discard(key)
+
+    async def _every(self, interval: float, fn: Callable[[], Awaitable[Any]]) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await fn()
+            except Exception as e:
+                print(f"Scheduled refresh failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': self.queue.qsize() if self.queue else 0,
+            'pending': len(self.pending),
+            'done': self.done,
+            'failed': self.failed,
+            'tracked': len(self.requests),
+        }
+
+refresher = Refresher()
+
+Metrics.Collected(
+    'unboxd_refresher_keys', "Background refreshes waiting in the queue, queued or running (pending), and keys tracked for the sweep",
+    ['state'], 'gauge', lambda: {(state,): refresher.stats()[state] for state in ['queued', 'pending', 'tracked']})
+Metrics.Collected(
+    'unboxd_refresher_jobs_total', "Background refreshes finished, by result",
+    ['result'], 'counter', lambda: {(result,): refresher.stats()[result] for result in ['done', 'failed']})
@@ -1,9 +1,9 @@
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-import requests
 from typing import List, Dict, Any, Union
 import json
+from components.Session import governor, LETTERBOXD_URL
+from components import Extract, Metrics, Parser
 
 class UserReviewCountError(ValueError):
     status_code = 400
@@ -14,38 +14,43 @@ class UserReviewCountError(ValueError):
 
 class ReviewScraper():
 
-    def __init__(self, user):
+    def __init__(self, user, session: aiohttp.ClientSession):
         self.user = user
-
-    async def fetch(self, session: aiohttp.ClientSession, url: str) -> Union[str, None]:
-        try:
-            async with session.get(url) as response:
-                # print(f"Fetching {url}")
-                return await response.text()
-        except aiohttp.ClientError as e:
-            print(f"Client error while fetching {url}: {e}")
-        except asyncio.TimeoutError:
-            print(f"Timeout error while fetching {url}")
-        except Exception as e:
-            print(f"An error occurred while fetching {url}: {e}")
+        self.session = session
+
+    async def fetch(self, session: aiohttp.ClientSession, url: str, max_attempts: int = 3) -> Union[str, None]:
+        for attempt in range(max_attempts):
+            try:
+                async with governor.request(url) as slot:
+                    async with session.get(url) as response:
+                        # print(f"Fetching {url}")
+                        slot.observe(response)
+                        if response.status == 429 and attempt < max_attempts - 1:
+                            Metrics.FETCH_RETRIES.inc(slot.pattern)
+                            continue  # the governor holds the retry back until Retry-After has passed
+                        return await response.text()
+            except aiohttp.ClientError as e:
+                print(f"Client error while fetching {url}: {e}")
+            except asyncio.TimeoutError:
+                print(f"Timeout error while fetching {url}")
+            except Exception as e:
+                print(f"An error occurred while fetching {url}: {e}")
+            Metrics.FETCH_FAILURES.inc(Metrics.url_pattern(url))
+            return None
 
     async def extract_review(self, session: aiohttp.ClientSession, url: str) -> str:
-        full_url = f"https://letterboxd.com/{url}"
+        full_url = f"{LETTERBOXD_URL}{url}"
         html = await self.fetch(session, full_url)
-        soup = BeautifulSoup(html, "html.parser")
-        review = ' '.join([' '.join(p.stripped_strings) for p in soup.find("div", class_="review").select("p")])
-        return review
+        return await Parser.run(Extract.review_text, html)
 
     async def extract_likes_data(self, session: aiohttp.ClientSession, name: str, review_num: int = None) -> List[str]:
         if not review_num:
-            url = f"https://letterboxd.com/{self.user}/film/{name}/likes"
+            url = f"{LETTERBOXD_URL}/{self.user}/film/{name}/likes"
         else:
-            url = f"https://letterboxd.com/{self.user}/film/{name}/{review_num}/likes"
+            url = f"{LETTERBOXD_URL}/{self.user}/film/{name}/{review_num}/likes"
 
         html = await self.fetch(session, url)
-        soup = BeautifulSoup(html, "html.parser")
-        likers = [i.get("href") for i in soup.find_all("a", class_ = "name")]
-        return likers
+        return await Parser.run(Extract.likers, html)
 
     async def compile_data(self, session: aiohttp.ClientSession, url: str) -> Dict[str, Any]:
         
@@ -66,34 +71,30 @@ class ReviewScraper():
             "liked_by" : liked_by
         }
 
-    async def start_process(self, session: aiohttp.ClientSession, url: str) -> List[Dict[str, Any]]:
-        html = await self.fetch(session, url)
-        soup = BeautifulSoup(html, 'html.parser')
-
-        links = [i.find("a")["href"] for i in soup.find_all("li", class_="film-detail")]
+    async def process_page(self, session: aiohttp.ClientSession, html: str) -> List[Dict[str, Any]]:
+        links = await Parser.run(Extract.review_links, html)
         tasks = [self.compile_data(session, link) for link in links]
         reviews = await asyncio.gather(*tasks)
 
         return [review for review in reviews if review]
 
-    def page_nums(self) ->int:
-        url = f"https://letterboxd.com/{self.user}/films/reviews"
-        html = requests.get(url)
-        soup = BeautifulSoup(html.text, "html.parser")
-        try:
-            num_pages = int(soup.find_all("li", class_="paginate-page")[-1].get_text())
-        except:
-            num_pages = 1
-        return num_pages
+    async def start_process(self, session: aiohttp.ClientSession, url: str) -> List[Dict[str, Any]]:
+        html = await self.fetch(session, url)
+        return await self.process_page(session, html)
+
+    async def page_nums(self, html: str) -> int:
+        return await Parser.run(Extract.page_count, html)
 
     async def scrape(self) -> Dict[str,Dict[str, Any]]:
-        num_pages = self.page_nums()
-        urls = [f"https://letterboxd.com/{self.user}/films/reviews/page/{i}/" for i in range(1, num_pages + 1)]
+        first_page = await self.fetch(self.session, f"{LETTERBOXD_URL}/{self.user}/films/reviews/")
+        if first_page is None:
+            raise UserReviewCountError("You must review atleast 10 movies")
+        num_pages = await self.page_nums(first_page)
+        urls = [f"{LETTERBOXD_URL}/{self.user}/films/reviews/page/{i}/" for i in range(2, num_pages + 1)]
 
-        connector = aiohttp.TCPConnector(limit_per_host=5)  # Limit parallel connections
-        async with aiohttp.ClientSession(connector=connector) as session:
-                tasks = [self.start_process(session, url) for url in urls]
-                results = await asyncio.gather(*tasks)
+        tasks = [self.process_page(self.session, first_page)]
+        tasks += [self.start_process(self.session, url) for url in urls]
+        results = await asyncio.gather(*tasks)
 
         reviews = {}
         for review_list in results:
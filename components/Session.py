@@ -0,0 +1,43 @@
+import os
+import aiohttp
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from components.Governor import RateGovernor
+from components import Metrics
+
+load_dotenv()
+
+# upstream base URLs, overridable to point the scrapers at a local stand-in
+# (see benchmarks/upstream.py)
+LETTERBOXD_URL = os.getenv('LETTERBOXD_URL', 'https://letterboxd.com').rstrip('/')
+TMDB_URL = os.getenv('TMDB_URL', 'https://api.themoviedb.org').rstrip('/')
+
+# (requests per second, burst, max concurrent connections) per upstream host.
+# The rate is a hard limit unless GOVERNOR_RATE_CEILING is raised above 1,
+# in which case it is the floor the governor backs off to.
+# Everything that talks to letterboxd.com or TMDB goes through the shared
+# session and governor below, so these are the only limits that apply
+# process-wide.
+HOST_LIMITS: Dict[str, Tuple[float, int, int]] = {
+    urlsplit(LETTERBOXD_URL).netloc: (10, 20, 12),
+    'boxd.it': (10, 20, 12),
+    urlsplit(TMDB_URL).netloc: (40, 40, 20),
+}
+DEFAULT_HOST_LIMIT = (5, 10, 4)
+
+governor = RateGovernor(HOST_LIMITS, DEFAULT_HOST_LIMIT)
+
+Metrics.Collected(
+    'unboxd_governor', "Rate governor state per host: rate (requests/s), limit (concurrency), active, tokens, blocked_for (seconds)",
+    ['host', 'stat'], 'gauge',
+    lambda: {(host, stat): value for host, stats in governor.stats().items() for stat, value in stats.items()})
+
+def create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=sum(limit[2] for limit in HOST_LIMITS.values()),
+        limit_per_host=max(limit[2] for limit in HOST_LIMITS.values()),
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
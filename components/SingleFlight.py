@@ -0,0 +1,25 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+# Concurrent callers asking for the same key share one in-flight task instead
+# of each doing the work. The key is released as soon as the task finishes,
+# so later callers start fresh (and usually hit a cache the task filled).
+class SingleFlight:
+
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+        # one caller going away (e.g. a closed connection) must not cancel the others
+        return await asyncio.shield(task)
+
+    def _release(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved when every caller has gone
@@ -1,184 +1,468 @@
+import os
 import sqlite3
 import json
+import queue
+import asyncio
+import threading
+import time
+import numpy as np
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict, Any
-
-db = Path(__file__).parent / "movies.db"
-
-def create_static_table() -> None:
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-                CREATE TABLE IF NOT EXISTS staticData (
-                name TEXT PRIMARY KEY,
-                title TEXT,
-                tmdb_id INTEGER,
-                release_date TEXT,
-                countries TEXT ,
-                spoken_languages TEXT,
-                original_language TEXT,
-                genres TEXT,
-                runtime INTEGER,
-                actors TEXT,
-                director TEXT,
-                themes TEXT,
-                nanogenres TEXT
-                )
-            '''
-        )
+from typing import List, Optional, Tuple, Dict, Any, Callable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# where the .db files live; point it elsewhere to run against scratch databases
+DB_DIR = Path(os.getenv('DB_DIR', Path(__file__).parent))
+
+# One long-lived connection per database file. Reads run on worker threads,
+# writes are queued and committed by a dedicated writer thread that coalesces
+# everything queued within flush_interval into a single transaction.
+class Database:
+
+    def __init__(self, path: Path, schema: List[str], flush_interval: float = 0.5):
+        self.path = path
+        self.schema = schema
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+        # separate from _lock, which commits and reads hold for as long as they run:
+        # write() is called from the event loop and must never wait on the disk
+        self._writer_lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=256)
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                with conn:
+                    for statement in self.schema:
+                        conn.execute(statement)
+                self._conn = conn
+            return self._conn
+
+    def _read(self, fn: Callable, *args) -> Any:
+        conn = self.connection()
+        with self._lock:
+            return fn(conn.cursor(), *args)
+
+    async def read(self, fn: Callable, *args) -> Any:
+        return await asyncio.to_thread(self._read, fn, *args)
+
+    def write(self, sql: str, rows: List[Tuple]) -> None:
+        self.write_all([(sql, rows)])
+
+    def write_all(self, statements: List[Tuple[str, List[Tuple]]]) -> None:
+        # statements that must be committed together, never split across transactions
+        statements = [(sql, rows) for sql, rows in statements if rows]
+        if not statements:
+            return
+        self._start_writer()
+        self._queue.put(statements)
+
+    def _start_writer(self) -> None:
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name=f"writer-{self.path.name}", daemon=True)
+                self._writer.start()
+
+    def _run(self) -> None:
+        conn = self.connection()
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            batch, waiters = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or waiters:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+            self._commit(conn, batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[List[Tuple[str, List[Tuple]]]]) -> None:
+        if not batch:
+            return
+        with self._lock:
+            try:
+                with conn:
+                    for statements in batch:
+                        for sql, rows in statements:
+                            conn.executemany(sql, rows)
+            except sqlite3.Error as e:
+                print(f"error {e} while committing {len(batch)} writes to {self.path.name}, retrying one by one")
+                for statements in batch:
+                    try:
+                        with conn:
+                            for sql, rows in statements:
+                                conn.executemany(sql, rows)
+                    except sqlite3.Error as e:
+                        print(f"error {e}, dropping {sum(len(rows) for _, rows in statements)} rows for {self.path.name}")
+
+    def flush(self) -> None:
+        if self._writer is None or not self._writer.is_alive():
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self) -> None:
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# SQLite caps the number of bound parameters per statement
+CHUNK_SIZE = 500
 
-def fetch_static_row(name: str) -> Optional[Tuple]:
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM staticData WHERE name = ?', (name,))
-        return cursor.fetchone()
-
-def insert_into_static(data: Tuple) -> None:
-    
-    name, tmdb_data, actors, dir, themes, nanogenres = data
-    try:
-        with sqlite3.connect(db) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                '''
-                INSERT INTO staticData (
-                    name, title, tmdb_id, release_date, countries, spoken_languages, original_language,
-                    genres, runtime, actors, director, themes, nanogenres
-                ) VALUES (?, ?, ?, ?, ?, ?, ? ,?, ?, ?, ?, ?, ?)
-                ''', (
-                    name, 
-                    tmdb_data['title'],
-                    tmdb_data['tmdb_id'],
-                    tmdb_data['release_date'],
-                    json.dumps(tmdb_data['countries']),
-                    json.dumps(tmdb_data['spoken_languages']),
-                    tmdb_data['og_lang'],
-                    json.dumps(tmdb_data['genres']),
-                    tmdb_data['runtime'],
-                    json.dumps(actors),
-                    dir,
-                    json.dumps(themes),
-                    json.dumps(nanogenres),
-
-                ))
-    except sqlite3.IntegrityError:
-        print(f"Entry with name '{name}' already exists. Skipping insert.")
-    except Exception as e:
-        print(f"error {e} for {name}")
-    
-
-def create_semistatic_table() -> None:
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-                CREATE TABLE IF NOT EXISTS semi_static_data (
-                name TEXT PRIMARY KEY,
-                timestamp DATE,
-                watched_by INTEGER,
-                liked_by INTEGER,
-                top250 INTEGER,
-                avg_rating FLOAT,
-                rating_count INTEGER
-                )
-            '''
+def _chunks(items: List[Any], size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _select_by_name(cursor: sqlite3.Cursor, table: str, names: List[str]) -> Dict[str, Tuple]:
+    rows = {}
+    for chunk in _chunks(list(set(names))):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT * FROM {table} WHERE name IN ({placeholders})', chunk)
+        rows.update({row[0]: row for row in cursor.fetchall()})
+    return rows
+
+db = DB_DIR / "movies.db"
+
+movies = Database(db, [
+    '''
+        CREATE TABLE IF NOT EXISTS staticData (
+        name TEXT PRIMARY KEY,
+        title TEXT,
+        tmdb_id INTEGER,
+        release_date TEXT,
+        countries TEXT ,
+        spoken_languages TEXT,
+        original_language TEXT,
+        genres TEXT,
+        runtime INTEGER,
+        actors TEXT,
+        director TEXT,
+        themes TEXT,
+        nanogenres TEXT
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS semi_static_data (
+        name TEXT PRIMARY KEY,
+        timestamp DATE,
+        watched_by INTEGER,
+        liked_by INTEGER,
+        top250 INTEGER,
+        avg_rating FLOAT,
+        rating_count INTEGER
         )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS film_uri (
+        uri TEXT PRIMARY KEY,
+        name TEXT
+        )
+    ''',
+])
+
+async def fetch_static_rows(names: List[str]) -> Dict[str, Tuple]:
+    return await movies.read(_select_by_name, 'staticData', names)
 
-def does_data_exists(name:str) -> Optional[Tuple]:
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT timestamp FROM semi_static_data WHERE name = ?", (name,))
-        return cursor.fetchone()
-
-def fetch_semistatic_row(name:str) -> Optional[Tuple]:
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM semi_static_data WHERE name = ?", (name,))
-        return cursor.fetchone()
-
-def insert_into_semistatic(data:Tuple) -> None:
-    name, ratings, stats, time = data
-    try:
-        with sqlite3.connect(db) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                '''
-                INSERT INTO semi_static_data (
-                    name, timestamp, watched_by, liked_by, top250, avg_rating, rating_count
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (name, time, stats['icon-watched'], stats['icon-liked'], stats['icon-top250'], ratings['rating'], ratings['count'])
-            )
-    except sqlite3.IntegrityError:
-        print(f"Entry with name '{name}' already exists. Skipping insert.")
-
-def update_semistatic(data:Tuple) -> None:
-    name, ratings, stats, time = data
-    with sqlite3.connect(db) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-            UPDATE semi_static_data 
-            SET timestamp = ?, watched_by = ?, liked_by = ?, top250 = ?, avg_rating = ?, rating_count = ?
-            WHERE name = ?
-        ''', (time, stats['icon-watched'], stats['icon-liked'], stats['icon-top250'], ratings['rating'], ratings['count'], name)
+def insert_static_rows(data: List[Tuple]) -> None:
+    rows = [
+        (
+            name,
+            tmdb_data['title'],
+            tmdb_data['tmdb_id'],
+            tmdb_data['release_date'],
+            json.dumps(tmdb_data['countries']),
+            json.dumps(tmdb_data['spoken_languages']),
+            tmdb_data['og_lang'],
+            json.dumps(tmdb_data['genres']),
+            tmdb_data['runtime'],
+            json.dumps(actors),
+            dir,
+            json.dumps(themes),
+            json.dumps(nanogenres),
         )
+        for name, tmdb_data, actors, dir, themes, nanogenres in data
+    ]
+    movies.write(
+        '''
+        INSERT OR IGNORE INTO staticData (
+            name, title, tmdb_id, release_date, countries, spoken_languages, original_language,
+            genres, runtime, actors, director, themes, nanogenres
+        ) VALUES (?, ?, ?, ?, ?, ?, ? ,?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+async def fetch_semistatic_rows(names: List[str]) -> Dict[str, Tuple]:
+    return await movies.read(_select_by_name, 'semi_static_data', names)
+
+def upsert_semistatic_rows(data: List[Tuple]) -> None:
+    rows = [
+        (name, time, stats['icon-watched'], stats['icon-liked'], stats['icon-top250'], ratings['rating'], ratings['count'])
+        for name, ratings, stats, time in data
+    ]
+    movies.write(
+        '''
+        INSERT INTO semi_static_data (
+            name, timestamp, watched_by, liked_by, top250, avg_rating, rating_count
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            timestamp = excluded.timestamp, watched_by = excluded.watched_by, liked_by = excluded.liked_by,
+            top250 = excluded.top250, avg_rating = excluded.avg_rating, rating_count = excluded.rating_count
+        ''', rows)
+
+
+# Letterboxd export URIs (boxd.it short links) resolved to film slugs
+
+def _select_uris(cursor: sqlite3.Cursor, uris: List[str]) -> Dict[str, str]:
+    names = {}
+    for chunk in _chunks(list(set(uris))):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT uri, name FROM film_uri WHERE uri IN ({placeholders})', chunk)
+        names.update(cursor.fetchall())
+    return names
+
+async def fetch_uri_names(uris: List[str]) -> Dict[str, str]:
+    return await movies.read(_select_uris, uris)
+
+def insert_uri_names(data: List[Tuple[str, str]]) -> None:
+    movies.write('INSERT OR IGNORE INTO film_uri (uri, name) VALUES (?, ?)', data)
+
+def _select_by_title(cursor: sqlite3.Cursor, films: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    matches: Dict[Tuple[str, str], List[str]] = {}
+    wanted = set(films)
+    for chunk in _chunks(list({title for title, _ in films})):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT title, substr(release_date, 1, 4), name FROM staticData WHERE title IN ({placeholders})', chunk)
+        for title, year, name in cursor.fetchall():
+            if (title, year) in wanted:
+                matches.setdefault((title, year), []).append(name)
+    # a title and year shared by two films is ambiguous, leave it to the URI
+    return {film: names[0] for film, names in matches.items() if len(names) == 1}
+
+async def fetch_names_by_title(films: List[Tuple[str, str]]) -> Dict[Tuple[str, str], str]:
+    return await movies.read(_select_by_title, films)
 
 
-# Ranking
+# Ranking: every user's films and ratings, with each film stored once and
+# referred to by an integer id
 
-users_db = Path(__file__).parent / "users.db"
+users_db = DB_DIR / "users.db"
 
-def create_friends_table():
-    with sqlite3.connect(users_db) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-                CREATE TABLE IF NOT EXISTS user_data (
-                name TEXT PRIMARY KEY,
-                timestamp DATE,
-                titles TEXT,
-                links TEXT,
-                ratings TEXT
-                )
-            '''
+users = Database(users_db, [
+    '''
+        CREATE TABLE IF NOT EXISTS films (
+        id INTEGER PRIMARY KEY,
+        slug TEXT UNIQUE NOT NULL,
+        title TEXT
         )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        timestamp DATE
+        )
+    ''',
+    # clustered on (user_id, film_id), so a user's ratings are read straight off the key
+    '''
+        CREATE TABLE IF NOT EXISTS user_ratings (
+        user_id INTEGER NOT NULL,
+        film_id INTEGER NOT NULL,
+        rating REAL,
+        PRIMARY KEY (user_id, film_id)
+        ) WITHOUT ROWID
+    ''',
+])
 
-def does_user_exist(user):
-    with sqlite3.connect(users_db) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT timestamp FROM user_data WHERE name = ?", (user,))
-        return cursor.fetchone()
+def _select_user(cursor: sqlite3.Cursor, user: str) -> Optional[Tuple]:
+    cursor.execute(
+        '''
+        SELECT timestamp, (SELECT count(*) FROM user_ratings WHERE user_id = users.id)
+        FROM users WHERE name = ?
+        ''', (user,))
+    return cursor.fetchone()
 
-def fetch_user_data(user):
-    with sqlite3.connect(users_db) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT titles, links, ratings FROM user_data WHERE name = ?", (user,))
-        return cursor.fetchone()
+async def fetch_user_data(user: str) -> Optional[Tuple]:
+    # (timestamp, film count) of the user's stored films
+    return await users.read(_select_user, user)
 
-def insert_user_data(data):
-    name, time, titles, links, ratings = data
-    try:
-        with sqlite3.connect(users_db) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                '''
-                INSERT INTO user_data (
-                    name, timestamp, titles, links, ratings
-                ) VALUES (?, ?, ?, ?, ?)
-            ''', (name, time, json.dumps(titles), json.dumps(links), json.dumps(ratings))
-            )
-    except sqlite3.IntegrityError:
-        print(f"Entry with name '{name}' already exists. Skipping insert.")
-
-def update_user_data(data):
+def _user_data_statements(data: Tuple) -> List[Tuple[str, List[Tuple]]]:
     name, time, titles, links, ratings = data
-    with sqlite3.connect(users_db) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            '''
-            UPDATE user_data 
-            SET timestamp = ?, titles = ?, links = ?, ratings = ?
-            WHERE name = ?
-        ''', (time, json.dumps(titles), json.dumps(links), json.dumps(ratings), name)
-        )
\ No newline at end of file
+    # films without a link can't be ranked; a film listed twice keeps its last rating
+    films = [(link, title, rating) for title, link, rating in zip(titles, links, ratings) if link is not None]
+    return [
+        ('INSERT INTO films (slug, title) VALUES (?, ?) ON CONFLICT(slug) DO UPDATE SET title = excluded.title WHERE title IS NULL',
+         [(link, title) for link, title, _ in films]),
+        ('INSERT INTO users (name, timestamp) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET timestamp = excluded.timestamp',
+         [(name, time)]),
+        ('DELETE FROM user_ratings WHERE user_id = (SELECT id FROM users WHERE name = ?)',
+         [(name,)]),
+        ('''
+        INSERT OR REPLACE INTO user_ratings (user_id, film_id, rating)
+        SELECT (SELECT id FROM users WHERE name = ?), id, ? FROM films WHERE slug = ?
+        ''', [(name, rating, link) for link, _, rating in films]),
+    ]
+
+def upsert_user_data(data: Tuple) -> None:
+    # in one transaction, so a reader never sees the user without their films
+    users.write_all(_user_data_statements(data))
+
+RATING_DTYPE = np.dtype([('user', np.int64), ('film', np.int64), ('rating', np.float64)])
+
+def _select_group_ratings(cursor: sqlite3.Cursor, names: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    ids = {}
+    for chunk in _chunks(list(set(names))):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT id, name FROM users WHERE name IN ({placeholders})', chunk)
+        ids.update(cursor.fetchall())
+
+    positions = {name: i for i, name in enumerate(names)}
+    parts = []
+    for chunk in _chunks(list(ids)):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT user_id, film_id, rating FROM user_ratings WHERE user_id IN ({placeholders}) AND rating IS NOT NULL', chunk)
+        parts.append(np.fromiter(cursor, dtype=RATING_DTYPE))
+    rows = np.concatenate(parts) if parts else np.empty(0, dtype=RATING_DTYPE)
+
+    # user ids -> positions in names; every row's user is one of ids, so searchsorted finds it exactly
+    user_ids = np.array(sorted(ids), dtype=np.int64)
+    lookup = np.array([positions[ids[user_id]] for user_id in user_ids], dtype=np.int64)
+    return lookup[np.searchsorted(user_ids, rows['user'])], rows['film'], rows['rating']
+
+async def fetch_group_ratings(names: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # every stored rating of these users as (position in names, film id, rating) arrays;
+    # films logged without a rating have rating 0
+    return await users.read(_select_group_ratings, names)
+
+def _select_films(cursor: sqlite3.Cursor, ids: List[int]) -> Dict[int, Tuple[str, str]]:
+    films = {}
+    for chunk in _chunks(list(set(ids))):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'SELECT id, slug, title FROM films WHERE id IN ({placeholders})', chunk)
+        films.update((id, (slug, title)) for id, slug, title in cursor.fetchall())
+    return films
+
+async def fetch_films(ids: List[int]) -> Dict[int, Tuple[str, str]]:
+    # film id -> (slug, title)
+    return await users.read(_select_films, ids)
+
+def flush_users() -> None:
+    users.flush()
+
+def _migrate_user_data(cursor: sqlite3.Cursor) -> int:
+    # users.db used to keep each user's titles, links and ratings as three JSON
+    # arrays in user_data; move them into the tables above once and drop it
+    if not cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_data'").fetchone():
+        return 0
+    conn = cursor.connection
+    with conn:
+        rows = cursor.execute('SELECT name, timestamp, titles, links, ratings FROM user_data').fetchall()
+        for name, timestamp, titles, links, ratings in rows:
+            for sql, params in _user_data_statements((name, timestamp, json.loads(titles), json.loads(links), json.loads(ratings))):
+                conn.executemany(sql, params)
+        conn.execute('DROP TABLE user_data')
+    conn.execute('VACUUM')  # hand back the space the blobs took
+    return len(rows)
+
+def migrate_user_data() -> None:
+    migrated = users._read(_migrate_user_data)
+    if migrated:
+        print(f"moved {migrated} users from user_data to user_ratings")
+
+
+# Last scraped film list per user, newest first, used for incremental refreshes;
+# timestamp is when the full scan it builds on was made
+
+snapshots_db = DB_DIR / "snapshots.db"
+
+snapshots = Database(snapshots_db, [
+    '''
+        CREATE TABLE IF NOT EXISTS film_snapshot (
+        name TEXT PRIMARY KEY,
+        timestamp DATE,
+        films TEXT
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS processed_data (
+        name TEXT PRIMARY KEY,
+        version TEXT,
+        fingerprint TEXT,
+        timestamp DATE,
+        data TEXT
+        )
+    ''',
+])
+
+def _select_snapshot(cursor: sqlite3.Cursor, user: str) -> Optional[Tuple]:
+    cursor.execute("SELECT timestamp, films FROM film_snapshot WHERE name = ?", (user,))
+    return cursor.fetchone()
+
+async def fetch_snapshot(user: str) -> Optional[Tuple]:
+    return await snapshots.read(_select_snapshot, user)
+
+def upsert_snapshot(data: Tuple) -> None:
+    name, time, films = data
+    snapshots.write(
+        '''
+        INSERT INTO film_snapshot (name, timestamp, films) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET timestamp = excluded.timestamp, films = excluded.films
+        ''', [(name, time, json.dumps(films))])
+
+
+# Processor results per user, valid for one fingerprint of the films they were
+# computed from and one version of the analytics code
+
+def _select_processed_data(cursor: sqlite3.Cursor, user: str, version: str, fingerprint: str) -> Optional[str]:
+    cursor.execute("SELECT data FROM processed_data WHERE name = ? AND version = ? AND fingerprint = ?", (user, version, fingerprint))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+async def fetch_processed_data(user: str, version: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    data = await snapshots.read(_select_processed_data, user, version, fingerprint)
+    return json.loads(data) if data is not None else None
+
+def upsert_processed_data(data: Tuple) -> None:
+    name, version, fingerprint, time, processed_data = data
+    snapshots.write(
+        '''
+        INSERT INTO processed_data (name, version, fingerprint, timestamp, data) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            version = excluded.version, fingerprint = excluded.fingerprint, timestamp = excluded.timestamp, data = excluded.data
+        ''', [(name, version, fingerprint, time, json.dumps(processed_data))])
+
+def purge_processed_data(version: str) -> None:
+    # results from other versions of the analytics can never be used again
+    snapshots.write('DELETE FROM processed_data WHERE version != ?', [(version,)])
+
+
+def open_databases() -> None:
+    movies.connection()
+    users.connection()
+    snapshots.connection()
+    migrate_user_data()
+
+def close_databases() -> None:
+    movies.close()
+    users.close()
+    snapshots.close()
@@ -1,10 +1,22 @@
-from typing import List, Any
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+from typing import List, Any, Dict, Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, PlainTextResponse
 import logging
-from components.MovieScraper import MovieDataScraper, MovieData, UserMovieCountError
+from components.MovieScraper import MovieDataScraper, MovieData, UserMovieCountError, SWEEP_INTERVAL
 from components.ReviewScraper import ReviewScraper, UserReviewCountError
 from components.Ranking import Ranking
-from components.DataProcessor import Processor
+from components.Export import ExportImporter, ExportError, MAX_EXPORT_SIZE
+from components.DataProcessor import process, ANALYTICS_VERSION
+from components.Session import create_session
+from components.Parser import start_pool, stop_pool
+from components.SingleFlight import SingleFlight
+from components.Refresher import refresher
+from components import Metrics
+from database.database import open_databases, close_databases, purge_processed_data
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -15,7 +27,25 @@ class MovieResponse(BaseModel):
     og_data: List[MovieData]  
     processed_data: Any 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_databases()
+    purge_processed_data(ANALYTICS_VERSION)
+    start_pool()
+    app.state.session = create_session()
+    refresher.start()
+    refresher.schedule(SWEEP_INTERVAL, lambda: MovieDataScraper.sweep(app.state.session))
+    yield
+    await refresher.stop()
+    await app.state.session.close()
+    stop_pool()
+    # flush queued cache writes before the process exits
+    await asyncio.to_thread(close_databases)
+
+app = FastAPI(lifespan=lifespan)
+
+# concurrent requests for the same user share one scrape
+flights = SingleFlight()
 
 allowed_origins = [
     "http://localhost:5173", 
@@ -23,6 +53,8 @@ allowed_origins = [
     "https://unboxdbyabhi.vercel.app"
 ]
 
+app.add_middleware(Metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,  
@@ -31,32 +63,116 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def movie_data_for_user(user: str, pages: Optional[asyncio.Queue] = None) -> Dict[str, Any]:
+    # pages, when given, gets each page of films as soon as it is scraped
+    logging.info(f"Getting Movie Data for {user}")
+    movie_data = []
+    async for page_data in MovieDataScraper(user, app.state.session).scrape_pages():
+        movie_data.extend(page_data)
+        if pages is not None:
+            pages.put_nowait(page_data)
+
+    processed_data = await process([movie.model_dump() for movie in movie_data], user, app.state.session)
+
+    return  {
+        'og_data' : movie_data,
+        'processed_data' : processed_data
+    }
+
 @app.get("/movies-data/", response_model=MovieResponse)
 async def movie_info(user:str):
     user = user.strip()
     try:
-        logging.info(f"Getting Movie Data for {user}")
-        movie_scraper = MovieDataScraper(user)
-        movie_data = await movie_scraper.scrape()
+        return await flights.do(('movies-data', user), lambda: movie_data_for_user(user))
+    except (KeyError, AttributeError):
+        # no films (empty frame) or no profile page: the user doesn't exist
+        raise HTTPException(status_code=404, detail="Stat_404")
+    except UserMovieCountError:
+        raise HTTPException(status_code=400, detail="Stat_400")
+
+@app.post("/movies-data/upload/", response_model=MovieResponse)
+async def movie_info_upload(file: UploadFile, user: Optional[str] = None):
+    # a Letterboxd export ZIP: user-specific fields come from its CSVs, only
+    # film-level data missing from the cache is scraped
+    user = user.strip() if user else None
+    # one byte over is enough for read_export to turn it down
+    data = await file.read(MAX_EXPORT_SIZE + 1)
+    try:
+        logging.info(f"Importing export for {user or file.filename}")
+        importer = ExportImporter(user, app.state.session)
+        movie_data = await importer.import_export(data)
 
-        processor = Processor([movie.model_dump() for movie in movie_data], user)
-        processed_data = processor.main()
+        # uploads aren't authenticated, so their results are never stored under the user
+        processed_data = await process([movie.model_dump() for movie in movie_data], importer.user, app.state.session, store=False)
 
-        return  {
-            'og_data' : movie_data,
-            'processed_data' : processed_data
+        return {
+            'og_data': movie_data,
+            'processed_data': processed_data
         }
-    except KeyError:
+    except ExportError:
+        raise HTTPException(status_code=400, detail="Export_400")
+    except (KeyError, AttributeError):
         raise HTTPException(status_code=404, detail="Stat_404")
-    except UserMovieCountError:
-        raise HTTPException(status_code=400, detail="Stat_400")
+
+def stream_event(event: str, data: Any, sse: bool) -> str:
+    payload = jsonable_encoder(data)
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps({'event': event, 'data': payload}) + "\n"
+
+@app.get("/movies-data/stream/")
+async def movie_info_stream(user:str, request: Request):
+    user = user.strip()
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def events():
+        # shares the /movies-data/ flight: pages only come through the queue when this
+        # request started the scrape, one that joined a running scrape gets all the
+        # films in one event when it is done
+        pages = asyncio.Queue()
+        flight = asyncio.ensure_future(flights.do(('movies-data', user), lambda: movie_data_for_user(user, pages)))
+        get = None
+        streamed = False
+        try:
+            while not flight.done():
+                get = asyncio.ensure_future(pages.get())
+                await asyncio.wait({get, flight}, return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    streamed = True
+                    yield stream_event('og_data', get.result(), sse)
+                else:
+                    get.cancel()
+            while not pages.empty():
+                streamed = True
+                yield stream_event('og_data', pages.get_nowait(), sse)
+
+            result = flight.result()
+            if not streamed:
+                yield stream_event('og_data', result['og_data'], sse)
+            yield stream_event('processed_data', result['processed_data'], sse)
+        # the 200 has gone out already, so errors are reported as events
+        except (KeyError, AttributeError):
+            yield stream_event('error', {'detail': 'Stat_404'}, sse)
+        except UserMovieCountError:
+            yield stream_event('error', {'detail': 'Stat_400'}, sse)
+        except Exception:
+            logging.exception(f"Streaming Movie Data for {user} failed")
+            yield stream_event('error', {'detail': 'Internal Server Error'}, sse)
+        finally:
+            # a closed connection only leaves the flight, the scrape carries on for the others
+            if get is not None:
+                get.cancel()
+            flight.cancel()
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type)
 
 @app.get("/reviews/")
 async def reviews(user:str):
     user = user.strip()
     try:
         logging.info(f"Getting reviews for {user}")
-        review_scraper = ReviewScraper(user)
+        review_scraper = ReviewScraper(user, app.state.session)
         results = await review_scraper.scrape()
         return results
     except UserReviewCountError:
@@ -67,8 +183,8 @@ async def friends_ranking(user:str, group:str):
     user = user.strip()
     try:
         logging.info(f"Getting rank data for {user}")
-        ranker = Ranking(user, group)
-        results = await ranker.rank_friends()
+        ranker = Ranking(user, group, app.state.session)
+        results = await flights.do(('rank', user, group), ranker.rank_friends)
         return results
     except AttributeError:
         raise HTTPException(status_code=404, detail="Rank_404")
@@ -77,6 +193,10 @@ async def friends_ranking(user:str, group:str):
     except KeyError:
         raise HTTPException(status_code=400, detail="Rank_400")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(Metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def main():
     return "Hey"
@@ -0,0 +1,99 @@
+from pathlib import Path
+import pytest
+from components import Extract
+
+# Saved Letterboxd pages, trimmed to the markup Extract reads.
+#
+#   python -m pytest tests
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures'
+
+def fixture(name: str) -> str:
+    return (FIXTURES / name).read_text(encoding='utf-8')
+
+def test_page_count():
+    assert Extract.page_count(fixture('films_page.html')) == 14
+    assert Extract.page_count(fixture('diary.html')) == 3
+    assert Extract.page_count(fixture('reviews.html')) == 2
+    # no pagination at all is a single page
+    assert Extract.page_count(fixture('film.html')) == 1
+
+def test_movie_links():
+    links, reviews, liked, ratings = Extract.movie_links(fixture('films_page.html'))
+    assert links == ['/film/parasite-2019/', '/film/the-godfather/', '/film/paddington-2/']
+    assert reviews == [True, False, False]
+    assert liked == [True, False, True]
+    assert ratings == [5.0, 3.5, 0]
+
+def test_movie_titles():
+    links, titles, ratings = Extract.movie_titles(fixture('films_page.html'))
+    assert links == ['/film/parasite-2019/', '/film/the-godfather/', '/film/paddington-2/']
+    assert titles == ['Parasite', 'The Godfather', 'Paddington 2']
+    assert ratings == [5.0, 3.5, 0]
+
+def test_watch_activity():
+    # newest watch first; watched twice counts as a rewatch, likes don't count
+    assert Extract.watch_activity(fixture('activity.html')) == ('2024-03-09', True)
+    # dated with a nobr span instead of a time element
+    assert Extract.watch_activity(fixture('activity_logged.html')) == ('2022-08-21', False)
+    assert Extract.watch_activity(fixture('activity_watchlist.html')) == (None, False)
+
+def test_diary_entries():
+    assert Extract.diary_entries(fixture('diary.html')) == [
+        ('parasite-2019', '2024-03-09', True),
+        # no poster, the slug comes from the entry link
+        ('the-godfather', '2022-08-21', False),
+        ('parasite-2019', '2020-02-14', False),
+    ]
+
+def test_stats():
+    assert Extract.stats(fixture('film_stats.html')) == {'icon-watched': 2311604, 'icon-liked': 845120, 'icon-top250': 7}
+    assert Extract.stats(fixture('film_stats_obscure.html')) == {'icon-watched': 812, 'icon-liked': 0, 'icon-top250': 0}
+
+def test_average_rating():
+    assert Extract.average_rating(fixture('rating_histogram.html')) == {'rating': 4.52, 'count': 1604211}
+    # too few ratings for an average: weighted from the bars, empty ones included in the scale
+    assert Extract.average_rating(fixture('rating_histogram_bars.html')) == {'rating': 3.54, 'count': 40}
+
+def test_metadata():
+    assert Extract.metadata(fixture('film.html')) == (
+        'Francis Ford Coppola',
+        ['Marlon Brando', 'Al Pacino', 'James Caan'],
+        ['Crime, drugs and gangsters', 'Gritty crime and ruthless gangsters', 'Mafia crime family'],
+        '238',
+    )
+    assert Extract.metadata(fixture('film_sparse.html')) == ('', [], [], None)
+
+def test_nanogenres():
+    assert sorted(Extract.nanogenres(fixture('nanogenres.html'))) == ['Crime', 'Family', 'Mafia', 'Power', 'Violence']
+
+def test_profile():
+    assert Extract.profile_stats(fixture('profile.html')) == (131, 64, 'Alice Liddell')
+    assert Extract.profile_header(fixture('profile.html')) == (
+        'https://a.ltrbxd.com/resized/avatar/upload/1/2/3/4/alice-0-220-0-220-crop.jpg?v=1a2b3c',
+        'Alice Liddell',
+    )
+
+def test_profile_not_found():
+    # main answers these with a 404
+    with pytest.raises(AttributeError):
+        Extract.profile_stats(fixture('not_found.html'))
+    with pytest.raises(AttributeError):
+        Extract.profile_header(fixture('not_found.html'))
+
+def test_friend_list():
+    assert Extract.friend_list(fixture('following.html')) == (
+        ['Dave Bowman', 'HAL'],
+        ['/dave/', '/hal9000/'],
+        ['https://a.ltrbxd.com/resized/avatar/upload/9/8/7/dave-0-80-0-80-crop.jpg?v=9f8e7d', None],
+    )
+
+def test_reviews():
+    assert Extract.review_links(fixture('reviews.html')) == ['/alice/film/parasite-2019/1/', '/alice/film/the-godfather/']
+    assert Extract.review_text(fixture('review.html')) == 'The peach scene. The peach scene. Every staircase in this film goes somewhere worse.'
+    assert Extract.likers(fixture('likes.html')) == ['/dave/', '/hal9000/']
+
+def test_failed_fetch_raises():
+    # a failed fetch must not parse as an empty page and get cached
+    with pytest.raises(TypeError):
+        Extract.metadata(None)